@@ -0,0 +1,157 @@
+import time
+
+class StreamSettings:
+    """Frame rate, JPEG quality and resolution scale currently used by the camera producer."""
+
+    def __init__(self, fps: float, quality: int, scale: float = 1.0):
+        self.fps = fps
+        self.quality = quality
+        self.scale = scale
+
+    def to_dict(self) -> dict:
+        return {"fps": round(self.fps, 1), "quality": self.quality, "scale": self.scale}
+
+class LinkMonitor:
+    """Track one connection's send buffer, drain rate and lifetime delivery counters."""
+
+    def __init__(self, connection, channel="main"):
+        self.connection = connection
+        self.channel = channel
+        self.bytes_queued = 0
+        self.total_sent = 0
+        self.total_dropped = 0
+        self.latency_sum = 0.0
+        self._reset(time.monotonic())
+
+    def _reset(self, now: float) -> None:
+        self.window_start = now
+        self.window_drained_start = self.bytes_queued - self.buffered()
+        self.sent = 0
+        self.skipped = 0
+        self.max_buffered = 0
+
+    def buffered(self) -> int:
+        """Bytes written to the socket that the kernel has not accepted yet."""
+        transport = getattr(self.connection, "transport", None)
+        if transport is None:
+            return 0
+        return transport.get_write_buffer_size()
+
+    def is_congested(self, frame_size: int) -> bool:
+        """True when more than a frame is still waiting, so a new frame would only arrive stale."""
+        buffered = self.buffered()
+        self.max_buffered = max(self.max_buffered, buffered)
+        return buffered > frame_size
+
+    def on_sent(self, size: int, latency: float = 0.0) -> None:
+        """Record a frame handed to the socket; latency is capture-to-send time in seconds."""
+        self.bytes_queued += size
+        self.sent += 1
+        self.total_sent += 1
+        self.latency_sum += latency
+
+    def on_skipped(self) -> None:
+        self.skipped += 1
+        self.total_dropped += 1
+
+    def on_dropped(self, count: int) -> None:
+        """Record frames this client never saw because it was still busy with an older one."""
+        if count > 0:
+            self.total_dropped += count
+
+    def client_stats(self) -> dict:
+        address = getattr(self.connection, "remote_address", None)
+        return {
+            "client": f"{address[0]}:{address[1]}" if address else "unknown",
+            "channel": self.channel,
+            "sent": self.total_sent,
+            "dropped": self.total_dropped,
+            "avg_latency_ms": round(self.latency_sum / self.total_sent * 1000, 1) if self.total_sent else None,
+        }
+
+    def window(self) -> dict:
+        """Return stats for the window since the last call and start a new one."""
+        now = time.monotonic()
+        elapsed = max(now - self.window_start, 1e-6)
+        drained = (self.bytes_queued - self.buffered()) - self.window_drained_start
+        stats = {
+            "throughput_bps": drained / elapsed,
+            "max_buffered": self.max_buffered,
+            "sent": self.sent,
+            "skipped": self.skipped,
+        }
+        self._reset(now)
+        return stats
+
+# Everything the controller can turn, in the order it degrades them
+ADAPTIVE_KNOBS = ("quality", "fps", "scale")
+
+class AdaptiveController:
+    """Pick fps, JPEG quality and resolution scale from the state of the worst subscriber link.
+
+    When a link is congested the controller first lowers quality, then frame rate, then resolution.
+    After several clean windows it steps back up in the reverse order. All values stay within the
+    configured bounds. `knobs` lists what the encoder can actually change; the other steps are
+    skipped, and a quality the encoder does not control is reported as 0.
+    """
+
+    def __init__(self, min_fps=2.0, max_fps=10.0, min_quality=30, max_quality=70, min_scale=0.5,
+                 quality_step=10, fps_step=0.75, scale_steps=(1.0, 0.75, 0.5), recover_windows=3,
+                 buffer_limit=64 * 1024, knobs=ADAPTIVE_KNOBS):
+        self.knobs = set(knobs)
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.quality_step = quality_step
+        self.fps_step = fps_step
+        self.scale_steps = [s for s in scale_steps if s >= min_scale] if "scale" in self.knobs else []
+        self.scale_steps = self.scale_steps or [1.0]
+        self.recover_windows = recover_windows
+        self.buffer_limit = buffer_limit
+        self.clean_windows = 0
+        self.settings = StreamSettings(max_fps, max_quality if "quality" in self.knobs else 0, self.scale_steps[0])
+
+    def is_congested(self, window: dict, frame_bytes: float) -> bool:
+        if window["skipped"] > 0 or window["max_buffered"] > self.buffer_limit:
+            return True
+        # Data is piling up and the link drains less than the stream currently produces
+        demand = frame_bytes * self.settings.fps
+        return window["max_buffered"] > 0 and window["throughput_bps"] < 0.9 * demand
+
+    def update(self, windows, frame_bytes: float) -> bool:
+        """Feed one stats window per connected link; return True if the settings changed."""
+        if not windows:
+            return False
+        if any(self.is_congested(w, frame_bytes) for w in windows):
+            self.clean_windows = 0
+            return self._degrade()
+        self.clean_windows += 1
+        if self.clean_windows >= self.recover_windows:
+            self.clean_windows = 0
+            return self._recover()
+        return False
+
+    def _degrade(self) -> bool:
+        s = self.settings
+        if "quality" in self.knobs and s.quality > self.min_quality:
+            s.quality = max(self.min_quality, s.quality - self.quality_step)
+        elif "fps" in self.knobs and s.fps > self.min_fps:
+            s.fps = max(self.min_fps, s.fps * self.fps_step)
+        elif self.scale_steps.index(s.scale) < len(self.scale_steps) - 1:
+            s.scale = self.scale_steps[self.scale_steps.index(s.scale) + 1]
+        else:
+            return False
+        return True
+
+    def _recover(self) -> bool:
+        s = self.settings
+        if self.scale_steps.index(s.scale) > 0:
+            s.scale = self.scale_steps[self.scale_steps.index(s.scale) - 1]
+        elif "fps" in self.knobs and s.fps < self.max_fps:
+            s.fps = min(self.max_fps, s.fps / self.fps_step)
+        elif "quality" in self.knobs and s.quality < self.max_quality:
+            s.quality = min(self.max_quality, s.quality + self.quality_step)
+        else:
+            return False
+        return True
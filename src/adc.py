@@ -1,5 +1,8 @@
 import smbus  # Import the smbus module for I2C communication
+import numpy as np  # Import numpy for averaging oversampled reads
+import threading  # Import the threading module for the bus lock
 import time  # Import the time module for sleep functionality
+import robot_clock  # Import the shared robot clock for scan timestamps
 from parameter import ParameterManager  # Import the ParameterManager class from the parameter module
 
 class ADC:
@@ -11,23 +14,64 @@ class ADC:
         self.pcb_version = self.parameter_manager.get_pcb_version()           # Get the PCB version
         self.adc_voltage_coefficient = 3.3 if self.pcb_version == 1 else 5.2  # Set the ADC voltage coefficient based on the PCB version
         self.i2c_bus = smbus.SMBus(1)                                         # Initialize the I2C bus
+        self.lock = threading.Lock()                                          # Serialize command/read pairs from sampler threads
+        self.transactions = 0                                                 # Number of I2C transactions since start
+        self.unstable_reads = 0                                               # Reads that gave up before two bytes agreed
 
-    def _read_stable_byte(self) -> int:
-        """Read a stable byte from the ADC."""
+    def _read_stable_byte(self, max_retries: int = None) -> int:
+        """Read a stable byte from the ADC, retrying at most max_retries times (None retries forever)."""
+        retries = 0
         while True:
             value1 = self.i2c_bus.read_byte(self.I2C_ADDRESS)                 # Read the first byte from the ADC
             value2 = self.i2c_bus.read_byte(self.I2C_ADDRESS)                 # Read the second byte from the ADC
+            self.transactions += 2
             if value1 == value2:
                 return value1                                                 # Return the value if both reads are the same
+            if max_retries is not None and retries >= max_retries:
+                self.unstable_reads += 1
+                return value2                                                 # Give up and use the most recent byte
+            retries += 1
+
+    def _command(self, channel: int) -> int:
+        """Return the ADS7830 command byte for a single-ended read of the channel."""
+        return self.ADS7830_COMMAND | ((((channel << 2) | (channel >> 1)) & 0x07) << 4)
 
     def read_adc(self, channel: int) -> float:
         """Read the ADC value for the specified channel using ADS7830."""
-        command_set = self.ADS7830_COMMAND | ((((channel << 2) | (channel >> 1)) & 0x07) << 4)  # Calculate the command set for the specified channel
-        self.i2c_bus.write_byte(self.I2C_ADDRESS, command_set)                # Write the command set to the ADC
-        value = self._read_stable_byte()                                      # Read a stable byte from the ADC
+        command_set = self._command(channel)                                 # Calculate the command set for the specified channel
+        with self.lock:
+            self.i2c_bus.write_byte(self.I2C_ADDRESS, command_set)            # Write the command set to the ADC
+            self.transactions += 1
+            value = self._read_stable_byte()                                  # Read a stable byte from the ADC
         voltage = value / 255.0 * self.adc_voltage_coefficient                # Convert the ADC value to voltage
         return round(voltage, 2)                                              # Return the voltage rounded to 2 decimal places
 
+    def scan(self, channels, oversample: int = 4, max_retries: int = 3) -> dict:
+        """Read several channels in one pass and average `oversample` reads per channel.
+
+        Returns {channel: {"voltage", "timestamp", "transactions"}}, where timestamp is the middle of
+        that channel's reads and transactions counts its I2C transfers. Stability retries are capped
+        at max_retries per read so a noisy channel cannot stall the scan.
+        """
+        raw = np.empty((len(channels), oversample), dtype=np.uint8)
+        timestamps = []
+        transactions = []
+        with self.lock:
+            for row, channel in enumerate(channels):
+                start_time, start_transactions = robot_clock.now(), self.transactions
+                self.i2c_bus.write_byte(self.I2C_ADDRESS, self._command(channel))  # Select the channel once
+                self.transactions += 1
+                for column in range(oversample):
+                    raw[row, column] = self._read_stable_byte(max_retries)
+                timestamps.append((start_time + robot_clock.now()) / 2)
+                transactions.append(self.transactions - start_transactions)
+        voltages = raw.mean(axis=1) / 255.0 * self.adc_voltage_coefficient  # Average and convert all channels at once
+        return {
+            channel: {"voltage": round(float(voltages[row]), 3), "timestamp": timestamps[row],
+                      "transactions": transactions[row]}
+            for row, channel in enumerate(channels)
+        }
+
     def scan_i2c_bus(self) -> None:
         """Scan the I2C bus for connected devices."""
         print("Scanning I2C bus...")                                          # Print a message indicating the start of I2C bus scanning
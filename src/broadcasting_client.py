@@ -1,13 +1,18 @@
 import asyncio
 import websockets
 import json
+import time
+import robot_clock
 
 class BroadcastingClient:
-    def __init__(self, uri="ws://192.168.178.137:9901"):
+    def __init__(self, uri="ws://192.168.178.137:9901", sync_interval=5.0, clock=None):
         self.uri = uri
+        self.sync_interval = sync_interval  # Seconds between clock sync exchanges; 0 disables syncing
+        self.clock = clock or robot_clock.CLOCK
         self.ws = None
         self.should_run = True
         self.on_connect_callback = None  # new hook
+        self.on_message_callback = None  # async def callback(message_dict), for commands/events from the orchestrator
 
     async def connect_forever(self):
         while self.should_run:
@@ -19,7 +24,12 @@ class BroadcastingClient:
                 if self.on_connect_callback:
                     await self.on_connect_callback()
 
-                await self.listen()  # blocks until connection closes
+                sync_task = asyncio.create_task(self.clock_sync_loop()) if self.sync_interval else None
+                try:
+                    await self.listen()  # blocks until connection closes
+                finally:
+                    if sync_task:
+                        sync_task.cancel()
             except Exception as e:
                 print(f"[BroadcastingClient] Connection failed: {e}")
             print("[BroadcastingClient] Reconnecting in 2 seconds...")
@@ -28,10 +38,31 @@ class BroadcastingClient:
     async def listen(self):
         try:
             async for message in self.ws:
+                if '"clock_sync"' in message:
+                    received = time.time()  # t3, local clock
+                    data = json.loads(message)
+                    if data.get("event") == "clock_sync" and data.get("t0") is not None:
+                        self.clock.update(data["t0"], data["t1"], data["t2"], received)
+                        continue
                 print(f"[BroadcastingClient] Received message from orchestrator: {message}")
+                if self.on_message_callback:
+                    try:
+                        await self.on_message_callback(json.loads(message))
+                    except Exception as e:
+                        print(f"[BroadcastingClient] Message handler failed: {e}")
         except websockets.ConnectionClosed:
             print("[BroadcastingClient] Connection closed.")
 
+    async def clock_sync_loop(self):
+        # A short burst right after connecting gives a usable offset quickly; after that a
+        # slow trickle is enough to follow drift
+        for _ in range(4):
+            await self.send_message({"command": "clock_sync", "t0": time.time()})
+            await asyncio.sleep(0.25)
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            await self.send_message({"command": "clock_sync", "t0": time.time()})
+
     async def send_message(self, message_dict):
         if self.ws:
             try:
@@ -1,5 +1,9 @@
 import asyncio
+import json
 import websockets
+import robot_clock
+
+CLOCK_SYNC = '"clock_sync"'
 
 class BroadcastingServer:
     def __init__(self, host="0.0.0.0", port=9900):
@@ -17,6 +21,10 @@ class BroadcastingServer:
         print(f"[BroadcastingServer] Client connected: {websocket.remote_address}")
         try:
             async for message in websocket:
+                if CLOCK_SYNC in message:
+                    received = robot_clock.now()  # t1, taken before anything else touches the message
+                    if await self.answer_clock_sync(websocket, message, received):
+                        continue
                 print(f"[BroadcastingServer] Received: {message}")
                 if self.on_message_callback:
                     await self.on_message_callback(websocket, message)
@@ -25,6 +33,26 @@ class BroadcastingServer:
         finally:
             self.connected_clients.remove(websocket)
 
+    async def answer_clock_sync(self, websocket, message, received) -> bool:
+        """Reply to {"command": "clock_sync", "t0": ...} with the server's receive and send times.
+
+        Answered only to the sender and never passed to the message callback, so the orchestrator
+        does not relay it. Returns False if the message is not a clock sync request after all.
+        """
+        try:
+            data = json.loads(message)
+        except json.JSONDecodeError:
+            return False
+        if not isinstance(data, dict) or data.get("command") != "clock_sync":
+            return False
+        reply = {"event": "clock_sync", "t0": data.get("t0"), "t1": received}
+        reply["t2"] = robot_clock.now()
+        try:
+            await websocket.send(json.dumps(reply))
+        except websockets.ConnectionClosed:
+            pass
+        return True
+
     async def broadcast(self, message):
         if self.connected_clients:
             tasks = [client.send(message) for client in self.connected_clients]
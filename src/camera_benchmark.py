@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import base64
+import json
+import time
+import cv2
+import numpy as np
+import websockets
+from camera_frame import BINARY_SUBPROTOCOL, CameraFrame, parse_binary_frame
+
+# Compares the legacy base64-in-JSON camera frames with the binary frame mode:
+# bytes on the wire, CPU spent per frame serialising on the sender, and loopback throughput.
+
+def load_jpeg(path, width, height, quality):
+    if path:
+        with open(path, "rb") as f:
+            return f.read()
+    # Synthetic scene with gradients and noise so the JPEG size is in the range of a real camera frame
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[..., 0] = (x + y) / 2
+    frame[..., 1] = x
+    frame[..., 2] = y
+    noise = np.random.default_rng(0).integers(0, 32, size=frame.shape, dtype=np.uint8)
+    frame = cv2.add(frame, noise)
+    _, jpeg = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    return jpeg.tobytes()
+
+def serialise(mode, frame):
+    return frame.to_binary() if mode == "binary" else frame.to_json("picam")
+
+def measure_serialisation(mode, jpeg, width, height, frames):
+    sizes = 0
+    start = time.process_time()
+    for seq in range(frames):
+        # A fresh frame every iteration so the per-frame payload cache does not hide the cost
+        frame = CameraFrame(seq, time.time(), width, height, jpeg)
+        sizes += len(serialise(mode, frame))
+    cpu = time.process_time() - start
+    return sizes / frames, cpu / frames
+
+async def measure_loopback(mode, jpeg, width, height, frames, port):
+    async def sender(connection):
+        for seq in range(frames):
+            await connection.send(serialise(mode, CameraFrame(seq, time.time(), width, height, jpeg)))
+
+    subprotocols = [BINARY_SUBPROTOCOL] if mode == "binary" else None
+    async with websockets.serve(sender, "127.0.0.1", port, subprotocols=[BINARY_SUBPROTOCOL], max_size=None):
+        async with websockets.connect(f"ws://127.0.0.1:{port}", subprotocols=subprotocols, max_size=None) as ws:
+            received = 0
+            start = time.perf_counter()
+            for _ in range(frames):
+                message = await ws.recv()
+                if isinstance(message, bytes):
+                    received += len(parse_binary_frame(message).data)
+                else:
+                    received += len(base64.b64decode(json.loads(message)["image"]))
+            elapsed = time.perf_counter() - start
+    return frames / elapsed, received
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON vs binary camera frame modes")
+    parser.add_argument("--jpeg", type=str, default=None, help="JPEG file to use instead of a synthetic frame")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--quality", type=int, default=70)
+    parser.add_argument("--fps", type=float, default=10.0, help="Frame rate used to express bytes/s")
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--port", type=int, default=6690)
+    args = parser.parse_args()
+
+    jpeg = load_jpeg(args.jpeg, args.width, args.height, args.quality)
+    print(f"JPEG payload: {len(jpeg)} bytes, {args.frames} frames, bytes/s at {args.fps:g} fps")
+    print(f"{'mode':<8}{'bytes/frame':>14}{'bytes/s':>14}{'cpu us/frame':>15}{'loopback fps':>15}")
+    for mode in ("json", "binary"):
+        frame_bytes, cpu = measure_serialisation(mode, jpeg, args.width, args.height, args.frames)
+        loopback_fps, _ = asyncio.run(measure_loopback(mode, jpeg, args.width, args.height, args.frames, args.port))
+        print(f"{mode:<8}{frame_bytes:>14.0f}{frame_bytes * args.fps:>14.0f}{cpu * 1e6:>15.1f}{loopback_fps:>15.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import fcntl
+import struct
+import time
+from collections import deque
+from threading import Condition
+import robot_clock
+import cv2
+from picamera2.encoders import H264Encoder, MJPEGEncoder
+from picamera2.outputs import Output
+from camera_frame import ENCODING_H264, ENCODING_JPEG
+
+# V4L2 ioctl used to make the hardware H.264 encoder emit an IDR frame on demand
+VIDIOC_S_CTRL = 0xC008561C
+V4L2_CID_MPEG_VIDEO_FORCE_KEY_FRAME = 0x009909E5
+
+def sensor_time_to_wall(sensor_ns) -> float:
+    """Map a picamera2 SensorTimestamp (ns, CLOCK_MONOTONIC) to robot time in unix seconds."""
+    if sensor_ns is None:
+        return robot_clock.now()
+    return robot_clock.now() - (time.monotonic_ns() - sensor_ns) / 1e9
+
+def encoder_time_to_wall(timestamp_us, encoder) -> float:
+    # picamera2 encoders hand outputs the SensorTimestamp in microseconds minus the encoder's
+    # firsttimestamp, so the first frame is 0; add it back to get CLOCK_MONOTONIC again
+    if timestamp_us is None:
+        return sensor_time_to_wall(None)
+    first_us = getattr(encoder, "firsttimestamp", None) or 0
+    return sensor_time_to_wall((timestamp_us + first_us) * 1000)
+
+def capture_with_timestamp(picam2, stream="main"):
+    """Capture one array from the given stream together with its sensor timestamp mapped to robot time."""
+    request = picam2.capture_request()
+    try:
+        array = request.make_array(stream)
+        sensor_ns = request.get_metadata().get("SensorTimestamp")
+    finally:
+        request.release()
+    return array, sensor_time_to_wall(sensor_ns)
+
+def lores_config(lores_size):
+    # The Pi ISP can only produce the secondary lores stream in YUV420
+    return {"size": lores_size, "format": "YUV420"} if lores_size else None
+
+class OpenCVJpegBackend:
+    """Capture RGB arrays from picamera2 and JPEG-encode them on the CPU with OpenCV."""
+
+    name = "opencv"
+    encoding = ENCODING_JPEG
+    paced = True      # Frame rate is set by how often the capture worker calls read()
+    adaptive = ("quality", "fps", "scale")  # Everything follows the adaptive controller
+
+    def __init__(self, picam2, size=(640, 480), fps=10.0, quality=70, lores_size=None):
+        self.picam2 = picam2
+        self.size = size
+        self.lores_size = lores_size
+        self.fps = fps
+        self.quality = quality
+        self.scale = 1.0
+        self.motion_gate = None
+
+    def start(self) -> None:
+        self.picam2.configure(self.picam2.create_preview_configuration(main={"size": self.size},
+                                                                       lores=lores_config(self.lores_size)))
+        self.picam2.start()
+
+    def read(self):
+        """Block until the next frame is captured and return (jpeg bytes, width, height, timestamp, keyframe).
+
+        Returns None when the motion gate decides the frame is not worth encoding.
+        """
+        frame, timestamp = capture_with_timestamp(self.picam2)
+        if self.motion_gate and not self.motion_gate.should_pass(frame):
+            return None
+        if self.scale < 1.0:
+            frame = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        _, jpeg = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality])
+        height, width = frame.shape[:2]
+        return jpeg.tobytes(), width, height, timestamp, True
+
+    def apply_settings(self, settings) -> None:
+        """Adopt quality and resolution scale chosen by the adaptive controller."""
+        self.quality = settings.quality
+        self.scale = settings.scale
+
+    def request_keyframe(self) -> None:
+        pass  # Every JPEG is a keyframe
+
+    def stop(self) -> None:
+        self.picam2.stop()
+
+class StreamingOutput(Output):
+    """picamera2 output that keeps only the most recent encoded buffer, like Freenove's StreamingOutput."""
+
+    def __init__(self):
+        super().__init__()
+        self.frame = None
+        self.timestamp = None
+        self.keyframe = True
+        self.count = 0
+        self.condition = Condition()  # Initialize the condition variable for thread synchronization
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        with self.condition:
+            self.frame = bytes(frame)    # The encoder reuses its buffers, so take a copy
+            self.keyframe = keyframe
+            self.timestamp = timestamp
+            self.count += 1
+            self.condition.notify_all()  # Notify all waiting threads that new data is available
+
+    def wait_for_frame(self, last_count: int, timeout: float = 1.0):
+        """Wait for a buffer newer than last_count and return (count, frame, keyframe, timestamp)."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.count > last_count, timeout):
+                raise TimeoutError("No frame from encoder")
+            return self.count, self.frame, self.keyframe, self.timestamp
+
+class MjpegEncoderBackend:
+    """Let picamera2's MJPEGEncoder (V4L2 hardware codec on the Pi) produce ready-made JPEG buffers."""
+
+    name = "mjpeg"
+    encoding = ENCODING_JPEG
+    paced = True
+    adaptive = ("fps",)  # The hardware encoder keeps quality and resolution; pacing sets the frame rate
+
+    def __init__(self, picam2, size=(640, 480), fps=30.0, lores_size=None):
+        self.picam2 = picam2
+        self.size = size
+        self.lores_size = lores_size
+        self.fps = fps
+        self.encoder = MJPEGEncoder()
+        self.output = StreamingOutput()
+        self.last_count = 0
+        self.quality = 0  # Not controlled per frame; reported as 0 in the frame header
+
+    def start(self) -> None:
+        config = self.picam2.create_video_configuration(main={"size": self.size},
+                                                        lores=lores_config(self.lores_size),
+                                                        controls={"FrameRate": self.fps})
+        self.picam2.configure(config)
+        self.picam2.start_recording(self.encoder, self.output)
+
+    def read(self):
+        """Block until the encoder delivers a frame and return (jpeg bytes, width, height, timestamp, keyframe)."""
+        self.last_count, jpeg, _, timestamp_us = self.output.wait_for_frame(self.last_count)
+        width, height = self.size
+        return jpeg, width, height, encoder_time_to_wall(timestamp_us, self.encoder), True
+
+    def apply_settings(self, settings) -> None:
+        # The hardware encoder keeps its quality and resolution; only the frame rate adapts,
+        # through the capture worker's pacing
+        pass
+
+    def request_keyframe(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        self.picam2.stop_recording()
+
+class FrameQueueOutput(Output):
+    """picamera2 output that queues every encoded buffer in order, since H.264 needs all of them."""
+
+    def __init__(self, capacity: int = 120):
+        super().__init__()
+        self.buffers = deque()
+        self.capacity = capacity
+        self.overflows = 0
+        self.condition = Condition()
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        with self.condition:
+            if len(self.buffers) >= self.capacity:
+                # Nobody is reading; drop the backlog, the reader resyncs on the next keyframe
+                self.buffers.clear()
+                self.overflows += 1
+            self.buffers.append((bytes(frame), keyframe, timestamp))
+            self.condition.notify_all()
+
+    def next_frame(self, timeout: float = 1.0):
+        """Pop the oldest buffer as (frame, keyframe, timestamp), waiting up to timeout seconds."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.buffers, timeout):
+                raise TimeoutError("No frame from encoder")
+            return self.buffers.popleft()
+
+class H264EncoderBackend:
+    """Stream H.264 access units from picamera2's hardware H264Encoder.
+
+    SPS/PPS headers are repeated in front of every keyframe so a subscriber can start decoding at
+    any keyframe. Delta frames after a gap are withheld until the next keyframe.
+    """
+
+    name = "h264"
+    encoding = ENCODING_H264
+    paced = False     # Every encoded frame must be forwarded, the camera frame rate sets the pace
+    adaptive = ()     # Bitrate is fixed for the lifetime of the encoder
+
+    def __init__(self, picam2, size=(640, 480), fps=30.0, bitrate=2000000, iperiod=None, lores_size=None,
+                 on_error=None):
+        self.picam2 = picam2
+        self.size = size
+        self.lores_size = lores_size
+        self.fps = fps
+        self.quality = 0
+        self.on_error = on_error  # Called with failures that do not stop the stream, such as a refused keyframe request
+        self.iperiod = iperiod or max(1, int(fps * 2))
+        self.encoder = H264Encoder(bitrate=bitrate, repeat=True, iperiod=self.iperiod)
+        self.output = FrameQueueOutput()
+        self.overflows_seen = 0
+        self.need_keyframe = True
+
+    def start(self) -> None:
+        config = self.picam2.create_video_configuration(main={"size": self.size},
+                                                        lores=lores_config(self.lores_size),
+                                                        controls={"FrameRate": self.fps})
+        self.picam2.configure(config)
+        self.picam2.start_recording(self.encoder, self.output)
+
+    def read(self):
+        """Block until the next decodable frame and return (access unit, width, height, timestamp, keyframe)."""
+        while True:
+            data, keyframe, timestamp_us = self.output.next_frame()
+            if self.output.overflows != self.overflows_seen:
+                self.overflows_seen = self.output.overflows
+                self.need_keyframe = True
+                self.request_keyframe()
+            if self.need_keyframe and not keyframe:
+                continue
+            self.need_keyframe = False
+            width, height = self.size
+            return data, width, height, encoder_time_to_wall(timestamp_us, self.encoder), keyframe
+
+    def apply_settings(self, settings) -> None:
+        pass
+
+    def request_keyframe(self) -> None:
+        """Ask the V4L2 encoder for an IDR frame; without it the next periodic keyframe is used."""
+        vd = getattr(self.encoder, "vd", None)
+        if vd is None:
+            return
+        try:
+            fcntl.ioctl(vd, VIDIOC_S_CTRL, struct.pack("Ii", V4L2_CID_MPEG_VIDEO_FORCE_KEY_FRAME, 1))
+        except OSError as e:
+            if self.on_error:
+                self.on_error(OSError(e.errno, f"Could not force H.264 keyframe: {e.strerror}"))
+
+    def stop(self) -> None:
+        self.picam2.stop_recording()
+
+ENCODER_BACKENDS = {
+    OpenCVJpegBackend.name: OpenCVJpegBackend,
+    MjpegEncoderBackend.name: MjpegEncoderBackend,
+    H264EncoderBackend.name: H264EncoderBackend,
+}
+
+def create_backend(name, picam2, size, fps, **options):
+    if name not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend: {name}. Valid backends are {list(ENCODER_BACKENDS.keys())}.")
+    return ENCODER_BACKENDS[name](picam2, size=size, fps=fps, **options)
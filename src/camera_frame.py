@@ -0,0 +1,81 @@
+import base64
+import json
+import struct
+
+# Binary frame layout (network byte order), followed directly by the encoded image bytes:
+#   magic (2s), version (B), encoding (B), flags (B), sequence (I), capture timestamp (d, unix seconds),
+#   width (H), height (H), JPEG quality (B, 0 if not applicable), target frame rate (B)
+FRAME_MAGIC = b"WF"
+FRAME_VERSION = 3
+FRAME_HEADER = struct.Struct("!2sBBBIdHHBB")
+
+# Subprotocol a client offers during the WebSocket handshake to receive binary frames. It names the
+# header version, so a client built for an older header (wheels.frame.v1 had no quality, fps or flags)
+# is not negotiated into frames it cannot parse; it falls back to the text frames instead.
+# Clients that do not offer it (e.g. PiCameraSensor.cs) get the legacy base64-in-JSON text frames.
+BINARY_SUBPROTOCOL = f"wheels.frame.v{FRAME_VERSION}"
+
+ENCODING_JPEG = 1
+ENCODING_H264 = 2    # Payload is the H.264 access unit (NAL units, Annex B) for one frame
+ENCODING_GREY = 3    # Raw 8-bit luma, width x height bytes
+ENCODING_YUV420 = 4  # Raw planar YUV420 as delivered by the ISP, rows of `width` bytes
+
+ENCODING_NAMES = {
+    ENCODING_JPEG: "jpeg",
+    ENCODING_H264: "h264",
+    ENCODING_GREY: "grey",
+    ENCODING_YUV420: "yuv420",
+}
+
+FLAG_KEYFRAME = 0x01
+
+class CameraFrame:
+    """One encoded camera frame plus the metadata that travels with it."""
+
+    __slots__ = ("seq", "timestamp", "width", "height", "encoding", "data", "quality", "fps", "keyframe",
+                 "_binary", "_json")
+
+    def __init__(self, seq: int, timestamp: float, width: int, height: int, data: bytes, encoding: int = ENCODING_JPEG,
+                 quality: int = 0, fps: float = 0, keyframe: bool = True):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.width = width
+        self.height = height
+        self.encoding = encoding
+        self.data = data
+        self.quality = quality
+        self.fps = fps
+        self.keyframe = keyframe
+        self._binary = None
+        self._json = None
+
+    def to_binary(self) -> bytes:
+        """Header plus raw image bytes, for clients that negotiated the binary subprotocol."""
+        if self._binary is None:
+            flags = FLAG_KEYFRAME if self.keyframe else 0
+            header = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, self.encoding, flags, self.seq & 0xFFFFFFFF,
+                                       self.timestamp, self.width, self.height, self.quality,
+                                       min(255, int(round(self.fps))))
+            self._binary = header + self.data
+        return self._binary
+
+    def to_json(self, sensor_name: str) -> str:
+        """Legacy text message with the image base64-encoded."""
+        if self._json is None:
+            b64_image = base64.b64encode(self.data).decode('utf-8')
+            message = {"sensor": sensor_name, "image": b64_image, "seq": self.seq, "timestamp": self.timestamp}
+            if self.encoding != ENCODING_JPEG:
+                # Raw images cannot be decoded without their geometry
+                message.update({"encoding": ENCODING_NAMES[self.encoding], "width": self.width, "height": self.height})
+            self._json = json.dumps(message)
+        return self._json
+
+def parse_binary_frame(message: bytes) -> CameraFrame:
+    """Decode a binary frame produced by CameraFrame.to_binary."""
+    magic, version, encoding, flags, seq, timestamp, width, height, quality, fps = FRAME_HEADER.unpack_from(message)
+    if magic != FRAME_MAGIC:
+        raise ValueError(f"Invalid frame magic: {magic!r}")
+    if version != FRAME_VERSION:
+        raise ValueError(f"Unsupported frame version: {version}")
+    return CameraFrame(seq, timestamp, width, height, bytes(message[FRAME_HEADER.size:]), encoding, quality, fps,
+                       bool(flags & FLAG_KEYFRAME))
@@ -0,0 +1,69 @@
+import asyncio
+import threading
+import time
+
+class CaptureWorker:
+    """Run a blocking producer (camera capture + encode) in a dedicated thread.
+
+    Results are handed to the event loop through a small bounded queue. When the loop falls
+    behind, the oldest queued item is dropped so consumers always get fresh data and the
+    thread never blocks on the loop. The producer may return None when it has nothing to publish.
+    """
+
+    def __init__(self, produce, interval: float = 0.0, queue_size: int = 2, on_error=None, name="capture-worker"):
+        self.produce = produce
+        self.interval = interval
+        self.on_error = on_error
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.loop = None
+        self.dropped = 0
+        self.produced = 0
+        self.running = threading.Event()
+        self.active = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.running.set()
+        self.active.set()  # Producing from the start; consumers call pause() when nobody is listening
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running.clear()
+        self.active.set()  # Release the thread if it is paused
+
+    def pause(self) -> None:
+        self.active.clear()
+
+    def resume(self) -> None:
+        self.active.set()
+
+    async def get(self):
+        return await self.queue.get()
+
+    def _run(self) -> None:
+        while self.running.is_set():
+            self.active.wait()
+            if not self.running.is_set():
+                break
+            started = time.monotonic()
+            try:
+                item = self.produce()
+            except Exception as e:
+                if self.on_error:
+                    self.loop.call_soon_threadsafe(self.on_error, e)
+                time.sleep(0.5)
+                continue
+            if item is not None:
+                self.produced += 1
+                self.loop.call_soon_threadsafe(self._hand_off, item)
+            remaining = self.interval - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def _hand_off(self, item) -> None:
+        # Runs on the event loop thread
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(item)
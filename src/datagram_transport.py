@@ -0,0 +1,118 @@
+import asyncio
+import random
+import struct
+import time
+import robot_clock
+
+DATAGRAM_MAGIC = b"WD"
+DATAGRAM_HEADER = struct.Struct("!2sBIId")  # magic, flags, session, seq, timestamp
+
+FLAG_TEXT = 0x01
+FLAG_REFRESH = 0x02
+
+class DatagramSender:
+    """Send latest-value-wins messages over UDP.
+
+    Every packet carries a sequence number and the message timestamp, so the receiver can throw
+    away anything older than what it already has instead of waiting for it like TCP would. The
+    newest message is re-sent every `refresh_interval` seconds without a newer one, so a lost
+    packet costs at most one refresh interval. A random session id lets receivers tell a
+    restarted sender from a stale packet.
+    """
+
+    def __init__(self, address, refresh_interval: float = 0.5):
+        self.address = address
+        self.refresh_interval = refresh_interval
+        self.session = random.getrandbits(32)
+        self.seq = 0
+        self.transport = None
+        self.refresh_task = None
+        self.last = None  # (message, timestamp) of the newest message
+        self.last_sent = 0.0
+        self.sent = 0
+        self.refreshed = 0
+
+    async def open(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol, remote_addr=self.address)
+        if self.refresh_interval:
+            self.refresh_task = asyncio.create_task(self.refresh_loop())
+
+    def send(self, message, timestamp: float = None) -> None:
+        """Send a str or bytes message right away; never blocks."""
+        self.last = (message, timestamp or robot_clock.now())
+        self._send(*self.last, 0)
+        self.sent += 1
+
+    def _send(self, message, timestamp: float, flags: int) -> None:
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+            flags |= FLAG_TEXT
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        self.transport.sendto(DATAGRAM_HEADER.pack(DATAGRAM_MAGIC, flags, self.session, self.seq, timestamp) + message)
+        self.last_sent = time.monotonic()
+
+    async def refresh_loop(self) -> None:
+        while self.transport:
+            await asyncio.sleep(self.refresh_interval)
+            if self.last is not None and time.monotonic() - self.last_sent >= self.refresh_interval:
+                self._send(*self.last, FLAG_REFRESH)
+                self.refreshed += 1
+
+    def close(self) -> None:
+        if self.refresh_task:
+            self.refresh_task.cancel()
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+
+class DatagramReceiver(asyncio.DatagramProtocol):
+    """Receive DatagramSender packets and deliver only those newer than anything seen before.
+
+    on_message(message, timestamp) is called on the event loop with a str (JSON) or bytes
+    message. Late and duplicate packets are counted as stale and dropped; gaps in the sequence
+    are counted as lost.
+    """
+
+    def __init__(self, on_message):
+        self.on_message = on_message
+        self.transport = None
+        self.session = None
+        self.last_seq = 0
+        self.last_received = None  # monotonic time of the newest accepted packet
+        self.received = 0
+        self.stale = 0
+        self.lost = 0
+        self.invalid = 0
+
+    async def listen(self, host: str, port: int) -> None:
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(lambda: self, local_addr=(host, port))
+
+    def datagram_received(self, data, addr) -> None:
+        if len(data) < DATAGRAM_HEADER.size or data[:2] != DATAGRAM_MAGIC:
+            self.invalid += 1
+            return
+        _, flags, session, seq, timestamp = DATAGRAM_HEADER.unpack_from(data)
+        if session != self.session:
+            # A new or restarted sender; start following its sequence
+            self.session = session
+            self.last_seq = (seq - 1) & 0xFFFFFFFF
+        delta = (seq - self.last_seq) & 0xFFFFFFFF
+        if delta == 0 or delta >= 0x80000000:
+            self.stale += 1
+            return
+        self.lost += delta - 1
+        self.last_seq = seq
+        self.received += 1
+        self.last_received = time.monotonic()
+        payload = data[DATAGRAM_HEADER.size:]
+        self.on_message(payload.decode("utf-8") if flags & FLAG_TEXT else payload, timestamp)
+
+    def stats(self) -> dict:
+        return {"received": self.received, "stale": self.stale, "lost": self.lost, "invalid": self.invalid}
+
+    def close(self) -> None:
+        if self.transport:
+            self.transport.close()
+            self.transport = None
@@ -0,0 +1,98 @@
+import json
+import mmap
+import os
+import time
+from collections import deque
+from camera_frame import ENCODING_H264, ENCODING_NAMES
+
+class PreEventBuffer:
+    """Keep the last few seconds of already-encoded frames in one preallocated byte ring.
+
+    Frame bytes are copied into a fixed-size bytearray, or into a memory-mapped file when
+    `backing_file` is given, so memory use never grows. An index of (offset, length, metadata)
+    entries tracks what is still valid; entries are evicted when they get older than `seconds`
+    or when new data overwrites their bytes. `snapshot()` copies the window out so it can be
+    written to disk without holding up the capture loop.
+    """
+
+    def __init__(self, seconds: float = 10.0, capacity_bytes: int = 16 * 1024 * 1024, backing_file: str = None):
+        self.seconds = seconds
+        self.capacity = capacity_bytes
+        self.backing_file = backing_file
+        if backing_file:
+            self._fd = os.open(backing_file, os.O_RDWR | os.O_CREAT, 0o644)
+            os.ftruncate(self._fd, capacity_bytes)
+            self.buffer = mmap.mmap(self._fd, capacity_bytes)
+        else:
+            self._fd = None
+            self.buffer = bytearray(capacity_bytes)
+        self.index = deque()
+        self.write_offset = 0
+
+    def append(self, frame) -> None:
+        size = len(frame.data)
+        if size > self.capacity:
+            return
+        if self.write_offset + size > self.capacity:
+            # Wrap around rather than split a frame; whatever is left in the unused tail is the oldest data
+            while self.index and self.index[0][0] >= self.write_offset:
+                self.index.popleft()
+            self.write_offset = 0
+        start, end = self.write_offset, self.write_offset + size
+        # Evict every entry whose bytes are about to be overwritten
+        while self.index and self._overlaps(self.index[0], start, end):
+            self.index.popleft()
+        self.buffer[start:end] = frame.data
+        self.index.append((start, size, frame.seq, frame.timestamp, frame.keyframe, frame.encoding,
+                           frame.width, frame.height))
+        self.write_offset = end
+        # Drop entries that fell out of the time window
+        cutoff = frame.timestamp - self.seconds
+        while self.index and self.index[0][3] < cutoff:
+            self.index.popleft()
+
+    @staticmethod
+    def _overlaps(entry, start, end) -> bool:
+        offset, size = entry[0], entry[1]
+        return offset < end and start < offset + size
+
+    def snapshot(self):
+        """Copy out the buffered window as a list of (metadata dict, bytes), oldest first."""
+        frames = []
+        for offset, size, seq, timestamp, keyframe, encoding, width, height in self.index:
+            frames.append(({"seq": seq, "timestamp": timestamp, "keyframe": keyframe,
+                            "encoding": ENCODING_NAMES[encoding], "width": width, "height": height},
+                           bytes(self.buffer[offset:offset + size])))
+        return frames
+
+    def close(self) -> None:
+        if self._fd is not None:
+            self.buffer.close()
+            os.close(self._fd)
+            self._fd = None
+
+def write_event_clip(frames, directory: str, name: str):
+    """Write a snapshot as one stream file plus a JSON index; returns the stream file path or None.
+
+    JPEG frames are concatenated into an .mjpeg file and H.264 access units into a raw .h264
+    stream starting at the first keyframe, so nothing is re-encoded. Meant to run in a worker thread.
+    """
+    if frames and frames[0][0]["encoding"] == ENCODING_NAMES[ENCODING_H264]:
+        first_key = next((i for i, (meta, _) in enumerate(frames) if meta["keyframe"]), None)
+        frames = frames[first_key:] if first_key is not None else []
+    if not frames:
+        return None
+
+    os.makedirs(directory, exist_ok=True)
+    extension = "h264" if frames[0][0]["encoding"] == ENCODING_NAMES[ENCODING_H264] else "mjpeg"
+    stream_path = os.path.join(directory, f"{name}.{extension}")
+    index = []
+    offset = 0
+    with open(stream_path, "wb") as stream_file:
+        for meta, data in frames:
+            stream_file.write(data)
+            index.append(dict(meta, offset=offset, length=len(data)))
+            offset += len(data)
+    with open(os.path.join(directory, f"{name}.json"), "w") as index_file:
+        json.dump({"name": name, "created": time.time(), "frames": index}, index_file)
+    return stream_path
@@ -0,0 +1,59 @@
+import asyncio
+from collections import deque
+
+class FanoutBuffer:
+    """Small ring buffer written by one producer and read by any number of subscribers.
+
+    Every published item gets a sequence number. Subscribers keep their own cursor (the last
+    sequence they consumed) and read at their own pace: a slow subscriber only falls behind
+    itself, and once it drops out of the ring it simply skips the items it missed.
+    Must be used from the event loop thread.
+    """
+
+    def __init__(self, capacity: int = 4):
+        self.items = deque(maxlen=capacity)
+        self.seq = 0
+        self.subscribers = 0
+        self._new_item = asyncio.Event()
+
+    def publish(self, item) -> int:
+        self.seq += 1
+        self.items.append((self.seq, item))
+        # Wake everyone waiting on the current event, then start a fresh one for the next item
+        self._new_item.set()
+        self._new_item = asyncio.Event()
+        return self.seq
+
+    def latest(self):
+        """Return (seq, item) of the newest item, or (0, None) if nothing was published yet."""
+        if not self.items:
+            return 0, None
+        return self.items[-1]
+
+    def since(self, cursor: int):
+        """Return ([(seq, item), ...] newer than cursor, number of items lost to the ring)."""
+        if not self.items or self.seq <= cursor:
+            return [], 0
+        oldest = self.items[0][0]
+        missed = max(0, oldest - cursor - 1)
+        start = max(0, cursor + 1 - oldest)
+        return [self.items[i] for i in range(start, len(self.items))], missed
+
+    async def wait(self, cursor: int) -> None:
+        """Wait until something newer than cursor has been published."""
+        while self.seq <= cursor:
+            await self._new_item.wait()
+
+    async def wait_for_subscribers(self) -> None:
+        while self.subscribers == 0:
+            await self._new_item.wait()
+
+    def subscribe(self) -> int:
+        """Register a subscriber and return its starting cursor (only newer items are delivered)."""
+        self.subscribers += 1
+        self._new_item.set()
+        self._new_item = asyncio.Event()
+        return self.seq
+
+    def unsubscribe(self) -> None:
+        self.subscribers = max(0, self.subscribers - 1)
@@ -1,5 +1,6 @@
 # Import the LineSensor class from gpiozero for reading infrared sensors
 from gpiozero import LineSensor
+from functools import partial
 import time
 
 # Define the Infrared class to manage infrared sensors
@@ -25,6 +26,16 @@ class Infrared:
         """Combine the values of all three infrared sensors into a single integer."""
         return (self.read_one_infrared(1) << 2) | (self.read_one_infrared(2) << 1) | self.read_one_infrared(3)
 
+    def set_callbacks(self, on_change) -> None:
+        """Call on_change(channel, value) from gpiozero's thread whenever a sensor finds or loses the line.
+
+        Values match read_one_infrared: gpiozero fires when_line when the sensor value drops, so a
+        found line reports 0 and a lost line reports 1.
+        """
+        for channel, sensor in self.sensors.items():
+            sensor.when_line = partial(on_change, channel, 0)
+            sensor.when_no_line = partial(on_change, channel, 1)
+
     def close(self) -> None:
         """Close each LineSensor object to release GPIO resources."""
         for sensor in self.sensors.values():
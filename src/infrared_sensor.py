@@ -2,21 +2,91 @@ import asyncio
 import json
 import signal
 import sys
+import time
 from infrared import Infrared
 from websockets.server import serve
 from websockets.exceptions import ConnectionClosed
+import robot_clock
 from broadcasting_client import BroadcastingClient
 from logger import Logger
+from wire_codec import SUBPROTOCOLS
+from sample_history import SampleHistory
+from sensor_sampler import SampleStream, SensorSampler
 
 class InfraredSensorServer:
-    def __init__(self, port=6602, sensor_name="infrared"):
+    """Serve the three line sensors as one bitmask value.
+
+    In "poll" mode the bitmask is sampled at sample_rate. In "event" mode gpiozero's when_line/
+    when_no_line callbacks publish a timestamped sample the moment any bit flips (after an optional
+    debounce), plus a keep-alive snapshot every `keepalive` seconds without changes. Clients then
+    get every change by default instead of a 10 Hz latest value.
+    """
+
+    def __init__(self, port=6602, sensor_name="infrared", mode="poll", sample_rate=100.0, rate=None,
+                 debounce_ms=0.0, keepalive=1.0, history_size=65536, history_file=None, publish=None,
+                 broadcasting_client=None):
         self.port = port
         self.sensor_name = sensor_name
+        self.mode = mode
+        self.debounce = debounce_ms / 1000.0
+        self.keepalive = keepalive
         self.infrared = Infrared()
         self.should_run = True
-        self.broadcasting_client = BroadcastingClient()
+        self.broadcasting_client = broadcasting_client or BroadcastingClient()
         self.log_path = f"/home/gbrouwer/Wheels/logs/{self.sensor_name}.log"
         self.logger = Logger(self.sensor_name, self.log_path)
+        history = SampleHistory(history_size, history_file, integer=True)
+        if mode == "event":
+            self.sampler = SensorSampler(None, rate=0.0, history=history)
+        else:
+            self.sampler = SensorSampler(self.infrared.read_all_infrared, rate=sample_rate, on_error=self.on_read_error,
+                                         history=history)
+        # Default output rate for clients that do not send a subscribe command (0 forwards every sample)
+        self.publish = publish  # Default publish policy (deadband / max silence) for every client
+        self.rate = rate if rate is not None else (0.0 if mode == "event" else 10.0)
+        self.state = None
+        self.candidate = None
+        self.pending = None
+        self.last_published = 0.0
+
+    def on_line_change(self, channel, value):
+        # Runs in gpiozero's callback thread
+        self.loop.call_soon_threadsafe(self.on_edge, channel, value, robot_clock.now())
+
+    def on_edge(self, channel, value, timestamp):
+        bit = 1 << (3 - channel)  # Channel 1 is the high bit, as in read_all_infrared
+        self.candidate = (self.candidate | bit) if value else (self.candidate & ~bit)
+        if self.pending:
+            self.pending.cancel()
+            self.pending = None
+        if self.debounce:
+            # Only publish once the new state has held for the debounce time
+            self.pending = self.loop.call_later(self.debounce, self.commit_state, timestamp)
+        else:
+            self.commit_state(timestamp)
+
+    def commit_state(self, timestamp):
+        self.pending = None
+        if self.candidate != self.state:
+            self.state = self.candidate
+            self.publish_state(timestamp)
+
+    def publish_state(self, timestamp):
+        self.last_published = time.monotonic()
+        self.sampler.publish(self.state, timestamp)
+
+    async def line_event_loop(self):
+        self.loop = asyncio.get_running_loop()
+        self.state = self.candidate = self.infrared.read_all_infrared()
+        self.infrared.set_callbacks(self.on_line_change)
+        self.publish_state(robot_clock.now())
+        while self.should_run:
+            await asyncio.sleep(self.keepalive)
+            if time.monotonic() - self.last_published >= self.keepalive:
+                self.publish_state(robot_clock.now())
+
+    def on_read_error(self, error):
+        self.logger.log(f"Read failed: {error}")
 
     async def stream(self, connection):
         self.logger.log("Unity client connected.")
@@ -25,18 +95,8 @@ class InfraredSensorServer:
             "status": "unity_client_connected"
         })
         try:
-            while self.should_run:
-                value = self.infrared.read_all_infrared()
-                payload = json.dumps({"sensor": self.sensor_name, "value": value})
-                await connection.send(payload)
-
-                # # Send to broadcasting channel
-                # await self.send_status_update({
-                #     "module": self.sensor_name,
-                #     "reading": {"value": value}
-                # })
-
-                await asyncio.sleep(0.1)
+            await SampleStream(connection, self.sampler, self.sensor_name, rate=self.rate, publish=self.publish,
+                               logger=self.logger).run()
         except ConnectionClosed:
             self.logger.log("Unity client disconnected.")
         except Exception as e:
@@ -44,7 +104,7 @@ class InfraredSensorServer:
 
     async def start_server(self):
         self.logger.log(f"Starting WebSocket server on port {self.port}")
-        return await serve(self.stream, "0.0.0.0", self.port)
+        return await serve(self.stream, "0.0.0.0", self.port, subprotocols=SUBPROTOCOLS)
 
     async def send_status_update(self, message_dict):
         if self.broadcasting_client.ws:
@@ -57,8 +117,19 @@ class InfraredSensorServer:
         with open(self.log_path, "a") as log_file:
             log_file.write(json.dumps(message_dict) + "\n")
 
-    async def run(self):
+    async def start(self):
+        """Start serving and return the awaitables that keep this module running.
+
+        With port=None no server is opened; a sensor hub routes connections to stream() instead.
+        """
+        sampler_task = asyncio.create_task(self.line_event_loop() if self.mode == "event" else self.sampler.run())
+        if self.port is None:
+            return [sampler_task]
         server = await self.start_server()
+        return [server.wait_closed(), sampler_task]
+
+    async def run(self):
+        tasks = await self.start()
 
         async def send_boot_status():
             await self.send_status_update({"module": self.sensor_name, "status": "boot_success"})
@@ -67,12 +138,16 @@ class InfraredSensorServer:
         broadcasting_task = asyncio.create_task(self.broadcasting_client.connect_forever())
 
         self.logger.log("Boot successful. Running server and broadcasting client.")
-        await asyncio.gather(server.wait_closed(), broadcasting_task)
+        await asyncio.gather(*tasks, broadcasting_task)
 
-    def stop(self):
+    def close(self):
+        self.should_run = False
+        self.sampler.stop()
         self.infrared.close()
+
+    def stop(self):
+        self.close()
         self.logger.log("Server shutdown complete.")
-        self.should_run = False
         sys.exit(0)
 
 if __name__ == "__main__":
@@ -80,9 +155,22 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", type=int, required=True, help="Port number for the sensor server")
+    parser.add_argument("--mode", choices=["poll", "event"], default="poll",
+                        help="Sample at --sample-rate, or publish on every line change")
+    parser.add_argument("--sample-rate", type=float, default=100.0, help="Hardware samples per second in poll mode")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="Default messages per second per client (default 10 in poll mode, every change in event mode)")
+    parser.add_argument("--debounce-ms", type=float, default=0.0, help="Time a changed state must hold in event mode")
+    parser.add_argument("--keepalive", type=float, default=1.0, help="Seconds between snapshots without changes in event mode")
+    parser.add_argument("--history-size", type=int, default=65536, help="Samples kept for history queries")
+    parser.add_argument("--history-file", type=str, default=None, help="Memory-map the history to this file")
+    parser.add_argument("--publish", type=json.loads, default=None,
+                        help='Publish policy as JSON, e.g. \'{"deadband": 0.02, "max_silence": 1.0}\'')
     args = parser.parse_args()
 
-    server = InfraredSensorServer(port=args.port)
+    server = InfraredSensorServer(port=args.port, mode=args.mode, sample_rate=args.sample_rate, rate=args.rate,
+                                  debounce_ms=args.debounce_ms, keepalive=args.keepalive,
+                                  history_size=args.history_size, history_file=args.history_file, publish=args.publish)
 
     def shutdown(*_):
         server.stop()
@@ -7,17 +7,41 @@ from websockets.server import serve
 from websockets.exceptions import ConnectionClosed
 from broadcasting_client import BroadcastingClient
 from logger import Logger
+from wire_codec import SUBPROTOCOLS
+from sample_history import SampleHistory
+from sensor_sampler import SampleStream, SensorSampler
 
 class LightSensorServer:
-    def __init__(self, channel=0, port=6601, sensor_name="light_sensor"):
+    def __init__(self, channel=0, port=6601, sensor_name="light_sensor", adc=None, scanner=None, sample_rate=100.0,
+                 rate=10.0, oversample=4, history_size=65536, history_file=None, publish=None,
+                 broadcasting_client=None):
         self.channel = channel
         self.port = port
         self.sensor_name = sensor_name
-        self.adc = ADC()
+        self.owns_adc = adc is None  # A sensor hub shares one ADC between sensors
+        self.adc = adc or ADC()
         self.should_run = True
-        self.broadcasting_client = BroadcastingClient()
+        self.broadcasting_client = broadcasting_client or BroadcastingClient()
         self.log_path = f"/home/gbrouwer/Wheels/logs/{self.sensor_name}.log"
         self.logger = Logger(self.sensor_name, self.log_path)
+        # A sensor hub passes one ADC scan shared by every channel; standalone we scan our own channel
+        self.owns_scanner = scanner is None
+        self.scanner = scanner or SensorSampler(lambda: self.adc.scan([self.channel], oversample), rate=sample_rate,
+                                                on_error=self.on_read_error)
+        self.sampler = SensorSampler(None, rate=self.scanner.rate, history=SampleHistory(history_size, history_file))
+        self.publish = publish  # Default publish policy (deadband / max silence) for every client
+        self.rate = rate  # Default output rate for clients that do not send a subscribe command
+
+    async def scan_loop(self):
+        # Pick our channel out of every scan, keeping the time that channel was actually read
+        with self.scanner.subscribe() as subscription:
+            while self.should_run:
+                for sample in await subscription.next():
+                    reading = sample.value[self.channel]
+                    self.sampler.publish(reading["voltage"], reading["timestamp"])
+
+    def on_read_error(self, error):
+        self.logger.log(f"Read failed: {error}")
 
     async def stream(self, connection):
         self.logger.log("Unity client connected.")
@@ -26,18 +50,8 @@ class LightSensorServer:
             "status": "unity_client_connected"
         })
         try:
-            while self.should_run:
-                voltage = self.adc.read_adc(self.channel)
-                payload = json.dumps({"sensor": self.sensor_name, "value": voltage})
-                await connection.send(payload)
-
-                # # Send to broadcasting channel
-                # await self.send_status_update({
-                #     "module": self.sensor_name,
-                #     "reading": {"value": voltage}
-                # })
-
-                await asyncio.sleep(0.1)
+            await SampleStream(connection, self.sampler, self.sensor_name, rate=self.rate, publish=self.publish,
+                               logger=self.logger).run()
         except ConnectionClosed:
             self.logger.log("Unity client disconnected.")
         except Exception as e:
@@ -45,7 +59,7 @@ class LightSensorServer:
 
     async def start_server(self):
         self.logger.log(f"Starting WebSocket server on port {self.port}")
-        return await serve(self.stream, "0.0.0.0", self.port)
+        return await serve(self.stream, "0.0.0.0", self.port, subprotocols=SUBPROTOCOLS)
 
     async def send_status_update(self, message_dict):
         if self.broadcasting_client.ws:
@@ -58,8 +72,21 @@ class LightSensorServer:
         with open(self.log_path, "a") as log_file:
             log_file.write(json.dumps(message_dict) + "\n")
 
-    async def run(self):
+    async def start(self):
+        """Start serving and return the awaitables that keep this module running.
+
+        With port=None no server is opened; a sensor hub routes connections to stream() instead.
+        """
+        tasks = [asyncio.create_task(self.scan_loop())]
+        if self.owns_scanner:
+            tasks.append(asyncio.create_task(self.scanner.run()))
+        if self.port is None:
+            return tasks
         server = await self.start_server()
+        return [server.wait_closed(), *tasks]
+
+    async def run(self):
+        tasks = await self.start()
 
         async def send_boot_status():
             await self.send_status_update({"module": self.sensor_name, "status": "boot_success"})
@@ -68,12 +95,19 @@ class LightSensorServer:
         broadcasting_task = asyncio.create_task(self.broadcasting_client.connect_forever())
 
         self.logger.log("Boot successful. Running server and broadcasting client.")
-        await asyncio.gather(server.wait_closed(), broadcasting_task)
+        await asyncio.gather(*tasks, broadcasting_task)
+
+    def close(self):
+        self.should_run = False
+        self.sampler.stop()
+        if self.owns_scanner:
+            self.scanner.stop()
+        if self.owns_adc:
+            self.adc.close_i2c()
 
     def stop(self):
-        self.adc.close_i2c()
+        self.close()
         self.logger.log("Server shutdown complete.")
-        self.should_run = False
         sys.exit(0)
 
 if __name__ == "__main__":
@@ -83,9 +117,18 @@ if __name__ == "__main__":
     parser.add_argument("--port", type=int, required=True, help="Port number for the sensor server")
     parser.add_argument("--channel", type=int, required=True, help="ADC channel number for the sensor")
     parser.add_argument("--sensor_name", type=str, required=True, help="Unique name for the sensor module")
+    parser.add_argument("--sample-rate", type=float, default=100.0, help="ADC scans per second")
+    parser.add_argument("--oversample", type=int, default=4, help="ADC reads averaged per sample")
+    parser.add_argument("--rate", type=float, default=10.0, help="Default messages per second per client")
+    parser.add_argument("--history-size", type=int, default=65536, help="Samples kept for history queries")
+    parser.add_argument("--history-file", type=str, default=None, help="Memory-map the history to this file")
+    parser.add_argument("--publish", type=json.loads, default=None,
+                        help='Publish policy as JSON, e.g. \'{"deadband": 0.02, "max_silence": 1.0}\'')
     args = parser.parse_args()
 
-    server = LightSensorServer(port=args.port, channel=args.channel, sensor_name=args.sensor_name)
+    server = LightSensorServer(port=args.port, channel=args.channel, sensor_name=args.sensor_name,
+                               sample_rate=args.sample_rate, rate=args.rate, oversample=args.oversample,
+                               history_size=args.history_size, history_file=args.history_file, publish=args.publish)
 
     def shutdown(*_):
         server.stop()
@@ -1,5 +1,6 @@
 import os
 import datetime
+import robot_clock
 
 class Logger:
     def __init__(self, module_name, log_path):
@@ -8,7 +9,7 @@ class Logger:
         os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
 
     def log(self, message):
-        timestamp = datetime.datetime.now().isoformat()
+        timestamp = datetime.datetime.fromtimestamp(robot_clock.now()).isoformat()
         line = f"[{timestamp}] [{self.module_name}] {message}"
         print(line)
         try:
@@ -0,0 +1,41 @@
+import asyncio
+import time
+
+class LoopLagMonitor:
+    """Measure how late the event loop wakes up a task that asks to sleep for a fixed interval.
+
+    A responsive loop shows lag close to zero; blocking work on the loop shows up directly as
+    lag of roughly the blocking time.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.should_run = True
+        self._reset()
+
+    def _reset(self) -> None:
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+
+    async def run(self) -> None:
+        while self.should_run:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - expected)
+            self.samples += 1
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+
+    def snapshot(self) -> dict:
+        """Return mean/max lag in milliseconds since the previous snapshot and start a new window."""
+        mean_lag = self.total_lag / self.samples if self.samples else 0.0
+        result = {
+            "loop_lag_ms_mean": round(mean_lag * 1000, 2),
+            "loop_lag_ms_max": round(self.max_lag * 1000, 2),
+        }
+        self._reset()
+        return result
+
+    def stop(self) -> None:
+        self.should_run = False
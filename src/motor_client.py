@@ -1,38 +1,67 @@
 import asyncio
-import json
 import signal
 import sys
 import argparse
+import time
 from motor import Motor
 import websockets
+import robot_clock
 from broadcasting_client import BroadcastingClient
+from datagram_transport import DatagramReceiver
 from logger import Logger
+from wire_codec import SUBPROTOCOLS, StructCodec, codec_for
 
 class MotorClient:
-    def __init__(self, host, port):
+    def __init__(self, host, port, udp_port=None, udp_timeout=1.0, control_rate=50.0):
         self.uri = f"ws://{host}:{port}/motor"
+        # Receiving only fills a single-slot mailbox; the actuation loop applies the newest command
+        # at most control_rate times a second, so a burst from Unity never queues up stale duties
+        self.control_rate = control_rate
+        self.mailbox = None  # (duty, sent timestamp or None) waiting to be applied
+        self.command_ready = asyncio.Event()
+        self.received = 0
+        self.coalesced = 0
+        self.applied = 0
+        self.metrics_interval = 5.0
+        # Applied duties are announced to the robot state at most announce_rate times a second
+        self.announce_rate = 5.0
+        self.applied_command = None  # (duty, applied timestamp, latency_ms or None) not announced yet
+        # Optional latest-wins UDP path for duty commands; the WebSocket stays up for reliable commands
+        self.udp_port = udp_port
+        self.udp_timeout = udp_timeout
+        self.receiver = DatagramReceiver(self.on_datagram)
+        self.datagram_codec = StructCodec()
+        self.timed_out = False
         self.motor = Motor()
         self.should_run = True
         self.broadcasting_client = BroadcastingClient()
         self.logger = Logger("motor_client", "/home/gbrouwer/Wheels/logs/motor_client.log")
+        self.last_duty = None
 
     async def listen_forever(self):
         self.logger.log(f"Starting. Target server: {self.uri}")
+        self.broadcasting_task = asyncio.create_task(self.broadcasting_client.connect_forever())
         await self.send_status_update({"module": "motor_client", "status": "boot_success"})
+        self.actuation_task = asyncio.create_task(self.actuation_loop())
+        self.metrics_task = asyncio.create_task(self.metrics_loop())
+        self.announce_task = asyncio.create_task(self.announce_loop())
+        if self.udp_port:
+            await self.receiver.listen("0.0.0.0", self.udp_port)
+            self.watchdog_task = asyncio.create_task(self.datagram_watchdog())
+            self.logger.log(f"Listening for motor datagrams on UDP port {self.udp_port}")
 
         while self.should_run:
             try:
                 self.logger.log(f"Attempting to connect...")
-                async with websockets.connect(self.uri) as websocket:
-                    self.logger.log(f"Connected to server.")
+                async with websockets.connect(self.uri, subprotocols=SUBPROTOCOLS) as websocket:
+                    codec = codec_for(websocket)  # Falls back to JSON when the server picks no subprotocol
+                    self.logger.log(f"Connected to server ({codec.name}).")
                     await self.send_status_update({"module": "motor_client", "status": "connected"})
 
                     async for message in websocket:
                         try:
-                            data = json.loads(message)
-                            d1, d2, d3, d4 = data.get("d1"), data.get("d2"), data.get("d3"), data.get("d4")
-                            self.logger.log(f"Received command: d1={d1}, d2={d2}, d3={d3}, d4={d4}")
-                            self.motor.move(d1, d2, d3, d4)
+                            data = codec.decode(message)
+                            self.post_command([data.get("d1"), data.get("d2"), data.get("d3"), data.get("d4")])
                         except Exception as e:
                             self.logger.log(f"Invalid message: {message} — {e}")
             except Exception as e:
@@ -42,6 +71,83 @@ class MotorClient:
             self.logger.log("Retrying in 2 seconds...")
             await asyncio.sleep(2)
 
+    def on_datagram(self, message, timestamp):
+        try:
+            data = self.datagram_codec.decode(message)
+            self.post_command([data.get("d1"), data.get("d2"), data.get("d3"), data.get("d4")], sent=timestamp)
+            self.timed_out = False
+        except Exception as e:
+            self.logger.log(f"Invalid datagram: {message} — {e}")
+
+    async def datagram_watchdog(self):
+        # Datagrams may simply stop arriving; stop the wheels instead of running on the last duty
+        while self.should_run:
+            await asyncio.sleep(self.udp_timeout / 2)
+            last = self.receiver.last_received
+            if last and not self.timed_out and time.monotonic() - last > self.udp_timeout:
+                self.timed_out = True
+                self.post_command([0, 0, 0, 0])  # Supersedes whatever is still waiting in the mailbox
+                self.logger.log(f"No motor datagram for {self.udp_timeout}s, stopping motors. {self.receiver.stats()}")
+
+    def post_command(self, duty, sent=None):
+        """Put a command in the mailbox, replacing one that has not been applied yet."""
+        self.received += 1
+        if self.mailbox is not None:
+            self.coalesced += 1
+        self.mailbox = (duty, sent)
+        self.command_ready.set()
+
+    async def actuation_loop(self):
+        loop = asyncio.get_running_loop()
+        period = 1.0 / self.control_rate
+        while self.should_run:
+            await self.command_ready.wait()
+            self.command_ready.clear()
+            duty, sent = self.mailbox
+            self.mailbox = None
+            started = time.monotonic()
+            try:
+                # The I2C writes block; run them off the loop so receiving keeps draining the socket
+                await loop.run_in_executor(None, self.motor.move, *duty)
+                self.applied += 1
+                applied = robot_clock.now()
+                # `sent` is the sender's robot-time stamp, which turns into the command's one-way latency
+                self.applied_command = (duty, applied, round((applied - sent) * 1000, 2) if sent else None)
+            except Exception as e:
+                self.logger.log(f"Failed to apply command {duty}: {e}")
+            remaining = period - (time.monotonic() - started)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+
+    async def metrics_loop(self):
+        while self.should_run:
+            await asyncio.sleep(self.metrics_interval)
+            await self.send_status_update({"module": "motor_client", "metrics": {
+                "received": self.received,
+                "coalesced": self.coalesced,
+                "applied": self.applied,
+                "duty": self.last_duty,
+                "control_rate": self.control_rate,
+            }})
+
+    async def announce_loop(self):
+        # Let the sensor hub's robot state know what the wheels are doing. Only the newest applied
+        # duty is sent, only when it changed, and without a log line: the orchestrator relays every
+        # event to every module, so this must stay far below the control rate
+        while self.should_run:
+            await asyncio.sleep(1.0 / self.announce_rate)
+            if self.applied_command is None:
+                continue
+            duty, applied, latency_ms = self.applied_command
+            self.applied_command = None
+            if duty == self.last_duty or not self.broadcasting_client.ws:
+                continue
+            self.last_duty = duty
+            message = {"module": "motor_client", "event": "motor_command", "duty": duty, "timestamp": applied}
+            if latency_ms is not None:
+                message["latency_ms"] = latency_ms
+            await self.broadcasting_client.send_message(message)
+
     async def send_status_update(self, message_dict):
         if self.broadcasting_client.ws:
             try:
@@ -60,9 +166,13 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--host", required=True)
     parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--udp-port", type=int, default=None, help="Also accept duty commands as UDP datagrams")
+    parser.add_argument("--udp-timeout", type=float, default=1.0, help="Stop the motors after this long without datagrams")
+    parser.add_argument("--control-rate", type=float, default=50.0, help="Maximum rate (Hz) at which commands are applied")
     args = parser.parse_args()
 
-    client = MotorClient(host=args.host, port=args.port)
+    client = MotorClient(host=args.host, port=args.port, udp_port=args.udp_port, udp_timeout=args.udp_timeout,
+                         control_rate=args.control_rate)
 
     def shutdown(*_):
         client.cleanup()
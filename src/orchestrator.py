@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
+import argparse
 import json
 import subprocess
 import platform
 import asyncio
+from broadcasting_client import BroadcastingClient
 from broadcasting_server import BroadcastingServer
 
 MODULES_FILE = "/home/gbrouwer/Wheels/config/modules.json"
+CLOCK_SOURCE = None  # Broadcasting server whose clock is robot time; None means this host is the reference
 
 def load_modules():
     with open(MODULES_FILE, "r") as f:
@@ -17,6 +20,8 @@ def am_i_pi():
 
 def launch_module(module):
     cmd = f"{module['cmd']} --port {module['port']}" if "port" in module else module['cmd']
+    if "publish" in module:
+        cmd = f"{cmd} --publish '{json.dumps(module['publish'])}'"
     print(f"[Orchestrator] Launching: {cmd} (host: {module.get('host', 'n/a')})")
     if module.get("sudo", False):
         cmd = f"sudo {cmd}"
@@ -38,6 +43,10 @@ async def handle_module_message(sender, message):
     status = data.get("status")
     global booted_modules, connected_unity_clients, actuator_clients_connected
 
+    # Events (e.g. an ultrasonic collision) and commands are relayed to every module
+    if "event" in data or "command" in data:
+        await broadcasting_server.broadcast(message)
+
     if module and status == "boot_success":
         booted_modules.add(module)
         print(f"[Orchestrator] Boot success: {module} ({len(booted_modules)}/{len(expected_modules)})")
@@ -108,6 +117,11 @@ async def main():
     broadcasting_server.set_on_message(handle_module_message)
     broadcasting_task = asyncio.create_task(broadcasting_server.run())
 
+    if CLOCK_SOURCE:
+        # Follow the reference clock so modules syncing against this orchestrator get robot time too
+        print(f"[Orchestrator] Syncing clock with {CLOCK_SOURCE}")
+        asyncio.create_task(BroadcastingClient(uri=CLOCK_SOURCE).connect_forever())
+
     await asyncio.sleep(1)
 
     for module in modules:
@@ -117,6 +131,15 @@ async def main():
     await broadcasting_task
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modules", type=str, default=MODULES_FILE,
+                        help="Module list to launch, e.g. config/modules_hub.json for the single-process sensor hub")
+    parser.add_argument("--clock-source", type=str, default=None,
+                        help="Broadcasting server to take robot time from, e.g. ws://<pi>:9900 on the PC")
+    args = parser.parse_args()
+    MODULES_FILE = args.modules
+    CLOCK_SOURCE = args.clock_source
+
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
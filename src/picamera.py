@@ -2,59 +2,268 @@ import asyncio
 import json
 import signal
 import sys
-import base64
+import time
 from picamera2 import Picamera2
-import cv2
 from websockets.server import serve
 from websockets.exceptions import ConnectionClosed
+import robot_clock
+from adaptive_stream import AdaptiveController, LinkMonitor
 from broadcasting_client import BroadcastingClient
+from camera_encoders import capture_with_timestamp, create_backend
+from camera_frame import BINARY_SUBPROTOCOL, ENCODING_GREY, ENCODING_H264, ENCODING_YUV420, CameraFrame
+from capture_worker import CaptureWorker
+from event_recorder import PreEventBuffer, write_event_clip
+from fanout import FanoutBuffer
 from logger import Logger
+from loop_monitor import LoopLagMonitor
+from motion_gate import MotionGate
+
+class CameraChannel:
+    """One subscribable camera stream with its own capture thread, fan-out ring and client links."""
+
+    def __init__(self, name, produce, interval, sequential=False, on_error=None):
+        self.name = name
+        # H.264 frames depend on each other, so subscribers must receive every frame in order
+        self.sequential = sequential
+        self.frames = FanoutBuffer(capacity=60 if sequential else 4)
+        self.worker = CaptureWorker(produce, interval=interval, queue_size=30 if sequential else 2,
+                                    on_error=on_error, name=f"capture-{name}")
+        self.links = set()
 
 class PicameraServer:
-    def __init__(self, port=6604, sensor_name="picam"):
+    def __init__(self, port=6604, sensor_name="picam", encoder="opencv", frame_size=(640, 480), fps=10.0,
+                 min_fps=2.0, min_quality=30, max_quality=70, min_scale=0.5, bitrate=2000000,
+                 lores_size=(320, 240), lores_fps=10.0, lores_format="grey", motion_threshold=0.0,
+                 motion_keepalive=2.0, prebuffer_seconds=0.0, prebuffer_bytes=16 * 1024 * 1024, prebuffer_file=None,
+                 recordings_dir="/home/gbrouwer/Wheels/recordings", broadcasting_client=None):
         self.port = port
         self.sensor_name = sensor_name
+        self.frame_size = frame_size
+        self.frame_seq = 0
+        self.frame_bytes = 0.0
+        self.lores_size = lores_size
+        self.lores_fps = lores_fps
+        self.lores_format = lores_format
+        self.lores_seq = 0
         self.picam2 = Picamera2()
-        self.picam2.configure(self.picam2.create_preview_configuration(main={"size": (640, 480)}))
-        self.picam2.start()
+        options = {"bitrate": bitrate, "on_error": self.on_capture_error} if encoder == "h264" else {}
+        self.encoder = create_backend(encoder, self.picam2, frame_size, fps, lores_size=lores_size, **options)
+        self.controller = AdaptiveController(min_fps=min_fps, max_fps=fps, min_quality=min_quality,
+                                             max_quality=max_quality, min_scale=min_scale, knobs=self.encoder.adaptive)
+        self.adapt_interval = 1.0
+        self.last_published_seq = 0
+        self.resync = False
+        self.encoder.apply_settings(self.controller.settings)
+        # Optional change detection: static scenes are neither encoded nor sent, apart from keep-alives
+        self.motion_gates = {}
+        if motion_threshold > 0:
+            if hasattr(self.encoder, "motion_gate"):
+                self.encoder.motion_gate = self.motion_gates["main"] = MotionGate(motion_threshold, motion_keepalive)
+            if lores_size:
+                self.motion_gates["lores"] = MotionGate(motion_threshold, motion_keepalive)
+        self.encoder.start()
+        self.main = CameraChannel("main", self.capture_frame, 1.0 / fps if self.encoder.paced else 0.0,
+                                  sequential=self.encoder.encoding == ENCODING_H264, on_error=self.on_capture_error)
+        self.channels = {"main": self.main}
+        if lores_size:
+            self.channels["lores"] = CameraChannel("lores", self.capture_lores, 1.0 / lores_fps,
+                                                   on_error=self.on_capture_error)
+        # Pre-event ring of encoded main-stream frames, dumped to disk on a command or collision event
+        self.recorder = PreEventBuffer(prebuffer_seconds, prebuffer_bytes, prebuffer_file) if prebuffer_seconds > 0 else None
+        self.recordings_dir = recordings_dir
+        self.dumping = False
+        self.loop_monitor = LoopLagMonitor()
+        self.metrics_interval = 5.0
         self.should_run = True
-        self.broadcasting_client = BroadcastingClient()
+        self.broadcasting_client = broadcasting_client or BroadcastingClient()
         self.log_path = f"/home/gbrouwer/Wheels/logs/{self.sensor_name}.log"
         self.logger = Logger(self.sensor_name, self.log_path)
 
+    def capture_frame(self):
+        # Runs on the capture worker thread, never on the event loop
+        result = self.encoder.read()
+        if result is None:
+            return None
+        data, width, height, timestamp, keyframe = result
+        self.frame_seq += 1
+        return CameraFrame(self.frame_seq, timestamp, width, height, data, encoding=self.encoder.encoding,
+                           quality=self.encoder.quality, fps=self.controller.settings.fps, keyframe=keyframe)
+
+    def capture_lores(self):
+        # Runs on the lores capture thread; the ISP already scaled the image, no CPU resizing needed
+        array, timestamp = capture_with_timestamp(self.picam2, "lores")
+        width, height = self.lores_size
+        gate = self.motion_gates.get("lores")
+        if gate and not gate.should_pass(array[:height, :width]):
+            return None
+        if self.lores_format == "grey":
+            data, encoding = array[:height, :width], ENCODING_GREY  # The Y plane is the greyscale image
+        else:
+            data, encoding = array, ENCODING_YUV420
+            width = array.shape[1]
+        self.lores_seq += 1
+        return CameraFrame(self.lores_seq, timestamp, width, height, data.tobytes(), encoding=encoding,
+                           fps=self.lores_fps)
+
+    def on_capture_error(self, error):
+        self.logger.log(f"Capture error: {error}")
+
+    async def capture_loop(self, channel):
+        # Single producer per channel: each frame is captured and encoded once, however many clients are watching
+        channel.worker.start()
+        while self.should_run:
+            # The main stream keeps running without subscribers while the pre-event buffer records
+            if channel.frames.subscribers == 0 and not (channel is self.main and self.recorder):
+                channel.worker.pause()
+                await channel.frames.wait_for_subscribers()
+                channel.worker.resume()
+            frame = await channel.worker.get()
+            if channel.sequential and not self.is_decodable(frame):
+                continue
+            if channel is self.main:
+                self.frame_bytes = 0.9 * self.frame_bytes + 0.1 * len(frame.data) if self.frame_bytes else len(frame.data)
+            channel.frames.publish(frame)
+            if channel is self.main and self.recorder:
+                self.recorder.append(frame)
+
+    def is_decodable(self, frame) -> bool:
+        # A frame lost in the worker hand-off breaks the H.264 chain until the next keyframe
+        if frame.seq != self.last_published_seq + 1 and not self.resync:
+            self.resync = True
+            self.encoder.request_keyframe()
+        self.last_published_seq = frame.seq
+        if self.resync and not frame.keyframe:
+            return False
+        self.resync = False
+        return True
+
+    async def handle_broadcast(self, data):
+        if data.get("command") == "dump_video" and data.get("target", self.sensor_name) == self.sensor_name:
+            await self.dump_prebuffer(data.get("reason", "command"))
+        elif data.get("event") == "collision":
+            await self.dump_prebuffer("collision")
+
+    async def dump_prebuffer(self, reason):
+        if self.recorder is None or self.dumping:
+            return
+        self.dumping = True
+        try:
+            frames = self.recorder.snapshot()
+            name = f"{self.sensor_name}_{reason}_{time.strftime('%Y%m%d-%H%M%S')}"
+            # Frames are already encoded, so this is a plain file write; keep it off the event loop
+            path = await asyncio.to_thread(write_event_clip, frames, self.recordings_dir, name)
+            self.logger.log(f"Dumped {len(frames)} pre-event frames to {path}")
+            await self.send_status_update({"module": self.sensor_name, "status": "video_dumped", "reason": reason,
+                                           "path": path, "frames": len(frames)})
+        except Exception as e:
+            self.logger.log(f"Failed to dump pre-event buffer: {e}")
+        finally:
+            self.dumping = False
+
+    async def adapt_loop(self):
+        while self.should_run:
+            await asyncio.sleep(self.adapt_interval)
+            windows = [link.window() for link in self.main.links]
+            if self.encoder.adaptive and self.controller.update(windows, self.frame_bytes):
+                settings = self.controller.settings
+                self.encoder.apply_settings(settings)
+                self.main.worker.interval = 1.0 / settings.fps
+                self.logger.log(f"Stream settings changed: {settings.to_dict()}")
+                await self.send_status_update({"module": self.sensor_name, "stream_settings": settings.to_dict()})
+
+    async def metrics_loop(self):
+        while self.should_run:
+            await asyncio.sleep(self.metrics_interval)
+            metrics = self.loop_monitor.snapshot()
+            metrics["channels"] = {
+                name: {
+                    "frames_captured": channel.worker.produced,
+                    "frames_dropped_handoff": channel.worker.dropped,
+                    "subscribers": channel.frames.subscribers,
+                    "frames_suppressed": self.motion_gates[name].suppressed if name in self.motion_gates else 0,
+                }
+                for name, channel in self.channels.items()
+            }
+            metrics["stream_settings"] = self.controller.settings.to_dict()
+            metrics["clients"] = [link.client_stats() for channel in self.channels.values() for link in channel.links]
+            await self.send_status_update({"module": self.sensor_name, "metrics": metrics})
+
     async def stream(self, connection):
-        self.logger.log("Unity client connected.")
+        # The last path segment picks the channel: "/lores" (or "/picamera/lores" on a sensor hub's shared port)
+        # for the small analysis stream, anything else for main
+        channel = self.channels.get(connection.path.rstrip("/").rsplit("/", 1)[-1], self.main)
+        binary = connection.subprotocol == BINARY_SUBPROTOCOL
+        if channel.sequential and not binary:
+            self.logger.log("Rejected client: H.264 stream requires the binary subprotocol.")
+            await connection.close(1003, f"H.264 stream requires the {BINARY_SUBPROTOCOL} subprotocol")
+            return
+        self.logger.log(f"Unity client connected to {channel.name} ({'binary' if binary else 'json'} frames).")
         await self.send_status_update({
             "module": self.sensor_name,
             "status": "unity_client_connected"
         })
 
+        link = LinkMonitor(connection, channel.name)
+        channel.links.add(link)
         try:
-            while self.should_run:
-                frame = self.picam2.capture_array()
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                # mean_rgb = frame.mean(axis=(0,1)).tolist()
-
-                _, jpeg = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 70])
-                b64_image = base64.b64encode(jpeg.tobytes()).decode('utf-8')
-
-                await connection.send(json.dumps({"sensor": self.sensor_name, "image": b64_image}))
-
-                # # Send mean RGB to broadcasting channel (not the full image)
-                # await self.send_status_update({
-                #     "module": self.sensor_name,
-                #     "reading": {"mean_rgb": mean_rgb}
-                # })
-
-                await asyncio.sleep(0.1)
+            if channel.sequential:
+                await self.send_sequential(connection, channel, link)
+            else:
+                await self.send_latest(connection, channel, link, binary)
         except ConnectionClosed:
             self.logger.log("Unity client disconnected.")
         except Exception as e:
             self.logger.log(f"Error: {e}")
+        finally:
+            channel.links.discard(link)
+            channel.frames.unsubscribe()
+
+    async def send_latest(self, connection, channel, link, binary):
+        cursor = channel.frames.subscribe()
+        while self.should_run:
+            # Latest wins: a client that is still busy sending skips the frames it missed
+            await channel.frames.wait(cursor)
+            latest, frame = channel.frames.latest()
+            link.on_dropped(latest - cursor - 1)
+            cursor = latest
+            payload = frame.to_binary() if binary else frame.to_json(self.sensor_name)
+            if link.is_congested(len(payload)):
+                # The previous frame has not drained yet; this one would only arrive stale
+                link.on_skipped()
+                continue
+            await connection.send(payload)
+            link.on_sent(len(payload), robot_clock.now() - frame.timestamp)
+
+    async def send_sequential(self, connection, channel, link):
+        cursor = channel.frames.subscribe()
+        # A new subscriber can only start decoding at a keyframe, so ask for one right away
+        need_keyframe = True
+        self.encoder.request_keyframe()
+        while self.should_run:
+            await channel.frames.wait(cursor)
+            items, missed = channel.frames.since(cursor)
+            if missed:
+                link.on_dropped(missed)
+                need_keyframe = True
+            for cursor, frame in items:
+                if need_keyframe:
+                    if not frame.keyframe:
+                        link.on_dropped(1)
+                        continue
+                    need_keyframe = False
+                payload = frame.to_binary()
+                if link.is_congested(self.controller.buffer_limit):
+                    # Skipping breaks the reference chain: wait for a fresh keyframe instead
+                    link.on_skipped()
+                    need_keyframe = True
+                    self.encoder.request_keyframe()
+                    continue
+                await connection.send(payload)
+                link.on_sent(len(payload), robot_clock.now() - frame.timestamp)
 
     async def start_server(self):
         self.logger.log(f"Starting WebSocket server on port {self.port}")
-        return await serve(self.stream, "0.0.0.0", self.port)
+        return await serve(self.stream, "0.0.0.0", self.port, subprotocols=[BINARY_SUBPROTOCOL])
 
     async def send_status_update(self, message_dict):
         if self.broadcasting_client.ws:
@@ -67,22 +276,43 @@ class PicameraServer:
         with open(self.log_path, "a") as log_file:
             log_file.write(json.dumps(message_dict) + "\n")
 
+    async def start(self):
+        """Start serving and return the awaitables that keep this module running.
+
+        With port=None no server is opened; a sensor hub routes connections to stream() instead.
+        """
+        tasks = [] if self.port is None else [(await self.start_server()).wait_closed()]
+        capture_tasks = [asyncio.create_task(self.capture_loop(channel)) for channel in self.channels.values()]
+        monitor_task = asyncio.create_task(self.loop_monitor.run())
+        metrics_task = asyncio.create_task(self.metrics_loop())
+        adapt_task = asyncio.create_task(self.adapt_loop())
+        return [*tasks, monitor_task, metrics_task, adapt_task, *capture_tasks]
+
     async def run(self):
-        server = await self.start_server()
+        tasks = await self.start()
 
         async def send_boot_status():
             await self.send_status_update({"module": self.sensor_name, "status": "boot_success"})
 
         self.broadcasting_client.on_connect_callback = send_boot_status
+        self.broadcasting_client.on_message_callback = self.handle_broadcast
         broadcasting_task = asyncio.create_task(self.broadcasting_client.connect_forever())
 
         self.logger.log("Boot successful. Running server and broadcasting client.")
-        await asyncio.gather(server.wait_closed(), broadcasting_task)
+        await asyncio.gather(*tasks, broadcasting_task)
+
+    def close(self):
+        self.should_run = False
+        for channel in self.channels.values():
+            channel.worker.stop()
+        self.loop_monitor.stop()
+        self.encoder.stop()
+        if self.recorder:
+            self.recorder.close()
 
     def stop(self):
-        self.picam2.stop()
+        self.close()
         self.logger.log("Server shutdown complete.")
-        self.should_run = False
         sys.exit(0)
 
 if __name__ == "__main__":
@@ -90,9 +320,41 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", type=int, required=True, help="Port number for the sensor server")
+    parser.add_argument("--encoder", type=str, default="opencv", choices=["opencv", "mjpeg", "h264"],
+                        help="opencv: CPU JPEG encode, mjpeg: hardware MJPEG encoder, h264: hardware H.264 encoder "
+                             "(binary subprotocol clients only)")
+    parser.add_argument("--bitrate", type=int, default=2000000, help="H.264 bitrate in bits/s")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--fps", type=float, default=10.0, help="Maximum frame rate")
+    parser.add_argument("--min-fps", type=float, default=2.0, help="Lowest frame rate the adaptive controller may use")
+    parser.add_argument("--min-quality", type=int, default=30, help="Lowest JPEG quality the adaptive controller may use")
+    parser.add_argument("--max-quality", type=int, default=70, help="Highest JPEG quality")
+    parser.add_argument("--min-scale", type=float, default=0.5, help="Smallest resolution scale the adaptive controller may use")
+    parser.add_argument("--lores-width", type=int, default=320, help="Width of the /lores analysis stream (0 disables it)")
+    parser.add_argument("--lores-height", type=int, default=240)
+    parser.add_argument("--lores-fps", type=float, default=10.0)
+    parser.add_argument("--lores-format", type=str, default="grey", choices=["grey", "yuv420"])
+    parser.add_argument("--motion-threshold", type=float, default=0.0,
+                        help="Skip frames whose mean grey-level change is below this (0 disables the motion gate)")
+    parser.add_argument("--motion-keepalive", type=float, default=2.0,
+                        help="Send a frame at least this often (s) even when nothing changes")
+    parser.add_argument("--prebuffer-seconds", type=float, default=0.0,
+                        help="Seconds of encoded video kept for dump-on-trigger (0 disables); "
+                             "keeps the main stream capturing when nobody is watching")
+    parser.add_argument("--prebuffer-mb", type=int, default=16, help="Size of the preallocated pre-event ring in MB")
+    parser.add_argument("--prebuffer-file", type=str, default=None,
+                        help="Back the pre-event ring with this memory-mapped file instead of RAM")
     args = parser.parse_args()
 
-    server = PicameraServer(port=args.port)
+    server = PicameraServer(port=args.port, encoder=args.encoder, frame_size=(args.width, args.height), fps=args.fps,
+                            min_fps=args.min_fps, min_quality=args.min_quality, max_quality=args.max_quality,
+                            min_scale=args.min_scale, bitrate=args.bitrate,
+                            lores_size=(args.lores_width, args.lores_height) if args.lores_width else None,
+                            lores_fps=args.lores_fps, lores_format=args.lores_format,
+                            motion_threshold=args.motion_threshold, motion_keepalive=args.motion_keepalive,
+                            prebuffer_seconds=args.prebuffer_seconds, prebuffer_bytes=args.prebuffer_mb * 1024 * 1024,
+                            prebuffer_file=args.prebuffer_file)
 
     def shutdown(*_):
         server.stop()
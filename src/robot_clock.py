@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import deque
+
+class RobotClock:
+    """Estimate how far the local clock is from robot time (the Pi orchestrator's clock).
+
+    Every exchange with the broadcasting server gives four timestamps: t0 when the request left,
+    t1 and t2 when the server received and answered it (in robot time), and t3 when the reply came
+    back. As in NTP, offset = ((t1 - t0) + (t2 - t3)) / 2 and round-trip delay = (t3 - t0) - (t2 - t1).
+    Queueing only ever adds delay, so of the last `window` exchanges the one with the lowest delay
+    is trusted. Drift is the least-squares slope of those filtered offsets over local time, so
+    `now()` stays close between exchanges.
+
+    Samplers, history and publish heartbeats assume time only moves forward, so the estimate is
+    never applied as a jump backwards. The correction slews towards it at `slew_rate` seconds per
+    second; only the first sync may step forward at once. `now()` never returns less than it
+    returned before, even if the local clock itself is stepped.
+    """
+
+    def __init__(self, window: int = 8, history: int = 16, min_drift_span: float = 30.0, max_drift: float = 500e-6,
+                 slew_rate: float = 0.05):
+        self.exchanges = deque(maxlen=window)
+        self.filtered = deque(maxlen=history)
+        self.min_drift_span = min_drift_span  # Seconds of filtered offsets needed before drift is estimated
+        self.max_drift = max_drift            # 500 ppm; anything beyond is noise, not a crystal
+        self.offset = 0.0
+        self.drift = 0.0
+        self.anchor = time.time()
+        self.slew_rate = slew_rate  # Robot time runs at most 5% fast or slow while catching up
+        self.correction = 0.0       # Offset actually applied by now(), converging on the estimate
+        self.corrected_at = self.anchor
+        self.last = 0.0
+        self.lock = threading.Lock()  # now() is called from capture and ADC threads as well as the loop
+        self.delay = None
+        self.synced = False
+        self.updates = 0
+
+    def now(self) -> float:
+        """Current robot time in unix seconds; never decreases."""
+        with self.lock:
+            local = time.time()
+            target = self.offset + self.drift * (local - self.anchor)
+            max_step = self.slew_rate * max(0.0, local - self.corrected_at)
+            self.correction += max(-max_step, min(max_step, target - self.correction))
+            self.corrected_at = local
+            self.last = max(self.last, local + self.correction)
+            return self.last
+
+    def update(self, t0: float, t1: float, t2: float, t3: float) -> None:
+        """Feed one exchange; t0 and t3 are local time.time() values, t1 and t2 robot time."""
+        delay = (t3 - t0) - (t2 - t1)
+        if delay < 0:
+            return  # Clock stepped during the exchange
+        self.exchanges.append(((t0 + t3) / 2, ((t1 - t0) + (t2 - t3)) / 2, delay))
+        local, offset, delay = min(self.exchanges, key=lambda e: e[2])
+        if not self.filtered or local != self.filtered[-1][0]:
+            self.filtered.append((local, offset))
+        with self.lock:
+            self.drift = self._fit_drift()
+            self.offset, self.anchor, self.delay = offset, local, delay
+            if not self.synced and offset > self.correction:
+                self.correction = offset  # Nothing has been compared against robot time yet; a forward step is safe
+        self.synced = True
+        self.updates += 1
+
+    def _fit_drift(self) -> float:
+        if len(self.filtered) < 4 or self.filtered[-1][0] - self.filtered[0][0] < self.min_drift_span:
+            return 0.0
+        n = len(self.filtered)
+        mean_t = sum(t for t, _ in self.filtered) / n
+        mean_o = sum(o for _, o in self.filtered) / n
+        var = sum((t - mean_t) ** 2 for t, _ in self.filtered)
+        slope = sum((t - mean_t) * (o - mean_o) for t, o in self.filtered) / var
+        return max(-self.max_drift, min(self.max_drift, slope))
+
+    def stats(self) -> dict:
+        return {
+            "synced": self.synced,
+            "offset_ms": round(self.offset * 1000, 3),
+            "correction_ms": round(self.correction * 1000, 3),
+            "drift_ppm": round(self.drift * 1e6, 2),
+            "delay_ms": round(self.delay * 1000, 3) if self.delay is not None else None,
+            "updates": self.updates,
+        }
+
+# One clock per process; every module timestamps samples, frames and commands with now()
+CLOCK = RobotClock()
+
+def now() -> float:
+    return CLOCK.now()
@@ -0,0 +1,252 @@
+import asyncio
+import itertools
+import json
+import struct
+from collections import deque
+import websockets
+from websockets.exceptions import ConnectionClosed, ConnectionClosedOK
+
+LINK_SUBPROTOCOL = "wheels.link.v2"
+LINK_HEADER = struct.Struct("!HBB")  # channel id, frame type, flags
+CREDIT = struct.Struct("!I")
+
+FRAME_DATA = 0
+FRAME_OPEN = 1
+FRAME_CREDIT = 2
+FRAME_CLOSE = 3
+
+FLAG_TEXT = 0x01
+
+class LinkChannel:
+    """One logical stream on a RobotLink.
+
+    It behaves like a websockets connection (send, recv, async iteration, close, path and
+    subprotocol), so the existing per-connection stream handlers can serve it unchanged. Sending
+    waits for credit from the peer; a latest_only channel never waits and instead replaces a
+    message that has not been sent yet.
+    """
+
+    def __init__(self, link, channel_id: int, name: str, priority: int = 1, latest_only: bool = False,
+                 subprotocol: str = None, credit: int = 0):
+        self.link = link
+        self.id = channel_id
+        self.name = name
+        self.path = "/" + name
+        self.priority = priority  # Lower goes first
+        self.latest_only = latest_only
+        self.subprotocol = subprotocol
+        self.remote_address = getattr(link.connection, "remote_address", None)
+        self.transport = None  # No socket buffer of its own; credits pace the sender
+        self.outbox = deque(maxlen=1 if latest_only else None)
+        self.inbox = asyncio.Queue()
+        self.credit = credit  # Messages the peer is ready to buffer; only the peer grants it
+        self.consumed = 0
+        self.closed = False
+        self.sent = 0
+        self.replaced = 0
+        self.last_turn = 0
+        self._space = asyncio.Event()
+
+    async def send(self, message) -> None:
+        if self.closed:
+            raise ConnectionClosedOK(None, None)
+        if self.latest_only:
+            if self.outbox:
+                self.replaced += 1
+        else:
+            while len(self.outbox) >= self.link.window:
+                self._space.clear()
+                await self._space.wait()
+                if self.closed:
+                    raise ConnectionClosedOK(None, None)
+        self.outbox.append(message)
+        self.link.wake_writer()
+
+    async def recv(self):
+        message = await self.inbox.get()
+        if message is None:
+            self.inbox.put_nowait(None)  # Keep the close marker for any later recv
+            raise ConnectionClosedOK(None, None)
+        # Hand credit back in batches of half a window
+        self.consumed += 1
+        if self.consumed >= max(1, self.link.window // 2):
+            self.link.send_control(self.id, FRAME_CREDIT, CREDIT.pack(self.consumed))
+            self.consumed = 0
+        return message
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.recv()
+        except ConnectionClosed:
+            raise StopAsyncIteration
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        if not self.closed:
+            self.link.send_control(self.id, FRAME_CLOSE, reason.encode("utf-8"))
+            self.link.remove(self)
+
+    def mark_closed(self) -> None:
+        self.closed = True
+        self.inbox.put_nowait(None)
+        self._space.set()
+
+class RobotLink:
+    """Carry many logical channels over one WebSocket connection.
+
+    Every frame is a binary WebSocket message starting with LINK_HEADER. A channel is opened with an
+    OPEN frame carrying its name, priority, subprotocol and the opener's receive window; ids are odd
+    for channels opened by the client and even for the server, so both sides can open channels. The
+    accepting side answers with a CREDIT frame for its own window, so each side sends against what the
+    other actually intends to buffer, even when their windows differ. One writer task sends control
+    frames first, then the queued message of the highest-priority channel that has credit, taking
+    channels of equal priority in turn. Receivers top credit up as their handler consumes, so a slow
+    channel (the camera) cannot starve a fast one (motor commands) or grow the peer's memory.
+    """
+
+    def __init__(self, connection, window: int = 16, accept=None, subprotocols=(), client: bool = True):
+        self.connection = connection
+        self.window = window
+        self.accept = accept  # async def accept(channel) for channels opened by the peer
+        self.subprotocols = list(subprotocols)
+        self.channels = {}
+        self.next_id = 1 if client else 2
+        self.control = deque()
+        self.turns = itertools.count(1)
+        self.handlers = set()
+        self._writable = asyncio.Event()
+
+    def open(self, name: str, priority: int = 1, latest_only: bool = False, subprotocol: str = None) -> LinkChannel:
+        channel = LinkChannel(self, self.next_id, name, priority, latest_only, subprotocol)
+        self.next_id += 2
+        self.channels[channel.id] = channel
+        # No credit until the peer answers with its window
+        options = {"name": name, "priority": priority, "latest_only": latest_only, "subprotocol": subprotocol,
+                   "window": self.window}
+        self.send_control(channel.id, FRAME_OPEN, json.dumps(options).encode("utf-8"))
+        return channel
+
+    def remove(self, channel: LinkChannel) -> None:
+        self.channels.pop(channel.id, None)
+        channel.mark_closed()
+
+    def send_control(self, channel_id: int, frame_type: int, payload: bytes) -> None:
+        self.control.append(LINK_HEADER.pack(channel_id, frame_type, 0) + payload)
+        self.wake_writer()
+
+    def wake_writer(self) -> None:
+        self._writable.set()
+
+    def next_frame(self):
+        if self.control:
+            return self.control.popleft()
+        ready = [channel for channel in self.channels.values() if channel.outbox and channel.credit > 0]
+        if not ready:
+            return None
+        channel = min(ready, key=lambda c: (c.priority, c.last_turn))
+        message = channel.outbox.popleft()
+        channel._space.set()
+        channel.credit -= 1
+        channel.sent += 1
+        channel.last_turn = next(self.turns)
+        if isinstance(message, str):
+            return LINK_HEADER.pack(channel.id, FRAME_DATA, FLAG_TEXT) + message.encode("utf-8")
+        return LINK_HEADER.pack(channel.id, FRAME_DATA, 0) + message
+
+    async def write_loop(self) -> None:
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                self._writable.clear()
+                await self._writable.wait()
+                continue
+            await self.connection.send(frame)
+
+    async def read_loop(self) -> None:
+        async for frame in self.connection:
+            channel_id, frame_type, flags = LINK_HEADER.unpack_from(frame)
+            payload = frame[LINK_HEADER.size:]
+            channel = self.channels.get(channel_id)
+            if frame_type == FRAME_DATA and channel:
+                channel.inbox.put_nowait(payload.decode("utf-8") if flags & FLAG_TEXT else bytes(payload))
+            elif frame_type == FRAME_CREDIT and channel:
+                channel.credit += CREDIT.unpack(payload)[0]
+                self.wake_writer()
+            elif frame_type == FRAME_CLOSE and channel:
+                self.channels.pop(channel_id, None)
+                channel.mark_closed()
+            elif frame_type == FRAME_OPEN:
+                self.on_open(channel_id, json.loads(payload))
+
+    def on_open(self, channel_id: int, options: dict) -> None:
+        subprotocol = options.get("subprotocol")
+        channel = LinkChannel(self, channel_id, options["name"], options.get("priority", 1),
+                              options.get("latest_only", False), subprotocol if subprotocol in self.subprotocols else None,
+                              credit=options["window"])
+        self.channels[channel_id] = channel
+        self.send_control(channel_id, FRAME_CREDIT, CREDIT.pack(self.window))
+        if self.accept:
+            task = asyncio.create_task(self.serve_channel(channel))
+            self.handlers.add(task)
+            task.add_done_callback(self.handlers.discard)
+
+    async def serve_channel(self, channel: LinkChannel) -> None:
+        try:
+            await self.accept(channel)
+        finally:
+            await channel.close()
+
+    async def run(self) -> None:
+        """Run until the underlying connection closes; every channel is then closed too."""
+        writer = asyncio.create_task(self.write_loop())
+        try:
+            await self.read_loop()
+        except ConnectionClosed:
+            pass
+        finally:
+            writer.cancel()
+            for channel in list(self.channels.values()):
+                channel.mark_closed()
+            self.channels.clear()
+
+    def stats(self) -> dict:
+        return {channel.name: {"sent": channel.sent, "replaced": channel.replaced, "credit": channel.credit}
+                for channel in self.channels.values()}
+
+class RobotLinkClient:
+    """Keep one link to a sensor hub open and reopen the same set of channels after every reconnect.
+
+    Handlers are registered once with add_channel and called with a fresh LinkChannel per connection,
+    so all streams come up (and go down) together instead of reconnecting one by one.
+    """
+
+    def __init__(self, uri: str, window: int = 16):
+        self.uri = uri
+        self.window = window
+        self.should_run = True
+        self.registrations = []
+
+    def add_channel(self, name: str, handler, priority: int = 1, latest_only: bool = False,
+                    subprotocol: str = None) -> None:
+        self.registrations.append((name, handler, priority, latest_only, subprotocol))
+
+    async def connect_forever(self) -> None:
+        while self.should_run:
+            try:
+                async with websockets.connect(self.uri, subprotocols=[LINK_SUBPROTOCOL]) as connection:
+                    print(f"[RobotLinkClient] Connected to {self.uri}")
+                    link = RobotLink(connection, self.window)
+                    tasks = [asyncio.create_task(handler(link.open(name, priority, latest_only, subprotocol)))
+                             for name, handler, priority, latest_only, subprotocol in self.registrations]
+                    await link.run()
+                    for task in tasks:
+                        task.cancel()
+            except Exception as e:
+                print(f"[RobotLinkClient] Connection failed: {e}")
+            print("[RobotLinkClient] Reconnecting in 2 seconds...")
+            await asyncio.sleep(2)
+
+    def stop(self) -> None:
+        self.should_run = False
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import sys
+import time
+from websockets.server import serve
+from websockets.exceptions import ConnectionClosed
+import robot_clock
+from broadcasting_client import BroadcastingClient
+from fanout import FanoutBuffer
+from logger import Logger
+from wire_codec import SUBPROTOCOLS, codec_for
+
+STATE_FIELDS = ["distance", "ir", "light_left", "light_right", "battery", "motor"]
+
+class RobotStateServer:
+    """Sample the latest value of every sensor at a fixed tick and stream one state vector.
+
+    Runs inside the sensor hub, which registers a source per field (see add_source). Each tick
+    produces one message {"t": ..., "seq": ..., "v": [...], "age_ms": [...]} with values in
+    STATE_FIELDS order, sent first as {"sensor": ..., "fields": [...]} to every new client. A field
+    is null until its sensor has produced a reading; age_ms says how old each value is at the
+    tick. The last motor command comes from the motor client's "motor_command" broadcast events.
+    Clients always get the newest state; a slow client skips ticks instead of queueing them. Each
+    tick is encoded at most once per wire codec, however many clients use that codec.
+    """
+
+    def __init__(self, port=6605, sensor_name="robot_state", rate=50.0, broadcasting_client=None):
+        self.port = port
+        self.sensor_name = sensor_name
+        self.rate = rate
+        self.should_run = True
+        self.broadcasting_client = broadcasting_client or BroadcastingClient()
+        self.log_path = f"/home/gbrouwer/Wheels/logs/{self.sensor_name}.log"
+        self.logger = Logger(self.sensor_name, self.log_path)
+        self.sources = {}
+        self.motor = None  # (timestamp, [d1, d2, d3, d4])
+        self.add_source("motor", lambda: self.motor)
+        self.states = FanoutBuffer(capacity=2)
+        self.header = {"sensor": self.sensor_name, "fields": STATE_FIELDS, "rate": self.rate}
+        self.encoded = {}  # codec name -> (seq, encoded state) of the newest tick
+
+    def add_source(self, field, latest):
+        """Register latest() -> (timestamp, value) or None as the source of one state field."""
+        if field not in STATE_FIELDS:
+            raise ValueError(f"Unknown state field: {field}. Valid fields are {STATE_FIELDS}.")
+        self.sources[field] = latest
+
+    async def handle_broadcast(self, data):
+        if data.get("event") == "motor_command":
+            self.motor = (data.get("timestamp", robot_clock.now()), data.get("duty"))
+
+    def snapshot(self, timestamp):
+        values, ages = [], []
+        for field in STATE_FIELDS:
+            reading = self.sources[field]() if field in self.sources else None
+            if reading is None:
+                values.append(None)
+                ages.append(None)
+            else:
+                values.append(reading[1])
+                ages.append(round((timestamp - reading[0]) * 1000))
+        return values, ages
+
+    async def tick_loop(self):
+        interval = 1.0 / self.rate
+        next_tick = time.monotonic()
+        seq = 0
+        while self.should_run:
+            timestamp = robot_clock.now()
+            values, ages = self.snapshot(timestamp)
+            seq += 1
+            self.states.publish({"t": timestamp, "seq": seq, "v": values, "age_ms": ages})
+            next_tick += interval
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                next_tick = time.monotonic()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    async def stream(self, connection):
+        self.logger.log("Unity client connected.")
+        await self.send_status_update({"module": self.sensor_name, "status": "unity_client_connected"})
+        codec = codec_for(connection)
+        cursor = self.states.subscribe()
+        try:
+            await connection.send(codec.encode(self.header))
+            while self.should_run:
+                await self.states.wait(cursor)
+                cursor, state = self.states.latest()
+                await connection.send(self.encode(cursor, state, codec))
+        except ConnectionClosed:
+            self.logger.log("Unity client disconnected.")
+        finally:
+            self.states.unsubscribe()
+
+    def encode(self, seq, state, codec):
+        cached = self.encoded.get(codec.name)
+        if cached is None or cached[0] != seq:
+            cached = (seq, codec.encode(state))
+            self.encoded[codec.name] = cached
+        return cached[1]
+
+    async def start_server(self):
+        self.logger.log(f"Starting WebSocket server on port {self.port}")
+        return await serve(self.stream, "0.0.0.0", self.port, subprotocols=SUBPROTOCOLS)
+
+    async def send_status_update(self, message_dict):
+        if self.broadcasting_client.ws:
+            try:
+                await self.broadcasting_client.send_message(message_dict)
+                self.logger.log(f"Sent status update: {message_dict}")
+            except Exception as e:
+                self.logger.log(f"Failed to send message to broadcaster: {e}")
+
+        with open(self.log_path, "a") as log_file:
+            log_file.write(json.dumps(message_dict) + "\n")
+
+    async def start(self):
+        """Start serving and return the awaitables that keep this module running.
+
+        With port=None no server is opened; a sensor hub routes connections to stream() instead.
+        """
+        tasks = [asyncio.create_task(self.tick_loop())]
+        if self.port is None:
+            return tasks
+        server = await self.start_server()
+        return [server.wait_closed(), *tasks]
+
+    def close(self):
+        self.should_run = False
+
+    def stop(self):
+        self.close()
+        self.logger.log("Server shutdown complete.")
+        sys.exit(0)
@@ -0,0 +1,83 @@
+import numpy as np
+
+class SampleHistory:
+    """Fixed-capacity ring of (timestamp, value) pairs for one sensor, answering time-range queries.
+
+    Timestamps and values live in one preallocated float64 array of shape (2, capacity), or in a
+    memory-mapped file when `backing_file` is given, so memory use never grows and the history can
+    be kept much larger than RAM would comfortably allow. Samples must arrive in time order; the
+    ring then consists of at most two sorted segments that are searched with np.searchsorted.
+    For `integer` sensors (the infrared bitmask) latest and minmax results are cast back to int64
+    so replies match the live stream; float64 holds such values exactly.
+    """
+
+    def __init__(self, capacity: int = 65536, backing_file: str = None, integer: bool = False):
+        self.capacity = capacity
+        self.backing_file = backing_file
+        self.integer = integer
+        if backing_file:
+            self.data = np.memmap(backing_file, dtype=np.float64, mode="w+", shape=(2, capacity))
+        else:
+            self.data = np.zeros((2, capacity), dtype=np.float64)
+        self.timestamps = self.data[0]
+        self.values = self.data[1]
+        self.head = 0  # Next index to write
+        self.count = 0
+
+    def append(self, timestamp: float, value) -> None:
+        self.timestamps[self.head] = timestamp
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def _segments(self):
+        if self.count < self.capacity:
+            return [(0, self.count)]
+        return [(self.head, self.capacity), (0, self.head)]
+
+    def range(self, start: float, end: float):
+        """Return (timestamps, values) copies of all samples with start <= timestamp <= end, oldest first."""
+        slices = []
+        for lo, hi in self._segments():
+            segment = self.timestamps[lo:hi]
+            i = lo + int(np.searchsorted(segment, start, "left"))
+            j = lo + int(np.searchsorted(segment, end, "right"))
+            if i < j:
+                slices.append(slice(i, j))
+        if not slices:
+            return np.empty(0), np.empty(0)
+        return (np.concatenate([self.timestamps[s] for s in slices]),
+                np.concatenate([self.values[s] for s in slices]))
+
+    def query(self, start: float, end: float, rate: float = 0.0, reduce: str = "latest"):
+        """Return (timestamps, values) for [start, end], reduced per 1/rate bucket (rate 0: one bucket).
+
+        Reductions match the live stream: latest, mean, median and minmax; minmax values are
+        returned as a {"min": array, "max": array} dict. Each bucket is stamped with its last sample.
+        """
+        timestamps, values = self.range(start, end)
+        if not len(timestamps):
+            values = values.astype(np.int64) if self.integer else values
+            return timestamps, values if reduce != "minmax" else {"min": values, "max": values}
+        if rate:
+            buckets = ((timestamps - start) * rate).astype(np.int64)
+            starts = np.flatnonzero(np.diff(buckets, prepend=-1))
+        else:
+            starts = np.array([0])
+        ends = np.append(starts[1:], len(values))
+        stamps = timestamps[ends - 1]
+        if self.integer and reduce in ("latest", "minmax"):
+            values = values.astype(np.int64)
+        if reduce == "latest":
+            return stamps, values[ends - 1]
+        if reduce == "mean":
+            return stamps, np.add.reduceat(values, starts) / (ends - starts)
+        if reduce == "minmax":
+            return stamps, {"min": np.minimum.reduceat(values, starts), "max": np.maximum.reduceat(values, starts)}
+        if reduce == "median":
+            return stamps, np.array([np.median(bucket) for bucket in np.split(values, starts[1:])])
+        raise ValueError(f"Unknown reduce: {reduce}. Valid reductions are ['latest', 'mean', 'minmax', 'median'].")
+
+    def close(self) -> None:
+        if self.backing_file:
+            self.data.flush()
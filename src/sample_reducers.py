@@ -0,0 +1,125 @@
+class LatestReducer:
+    """Keep only the newest value of the window."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.value = None
+
+    def add(self, value) -> None:
+        self.value = value
+
+    def result(self):
+        return self.value
+
+class MeanReducer:
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, value) -> None:
+        self.total += value
+        self.count += 1
+
+    def result(self):
+        return self.total / self.count if self.count else None
+
+class MinMaxReducer:
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.min = None
+        self.max = None
+
+    def add(self, value) -> None:
+        if self.min is None:
+            self.min = self.max = value
+        elif value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+
+    def result(self):
+        return None if self.min is None else {"min": self.min, "max": self.max}
+
+class MedianReducer:
+    """Streaming median estimate using the P-square algorithm (Jain & Chlamtac, 1985).
+
+    Five markers track the minimum, the quartiles, the median and the maximum; each sample moves
+    them with constant work and no samples are stored. Windows of up to five samples are exact.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.heights = []                           # Marker heights q0..q4
+        self.positions = [1, 2, 3, 4, 5]            # Actual marker positions
+        self.desired = [1.0, 2.0, 3.0, 4.0, 5.0]    # Desired marker positions
+        self.increments = (0.0, 0.25, 0.5, 0.75, 1.0)
+
+    def add(self, value) -> None:
+        q = self.heights
+        if len(q) < 5:
+            q.append(value)
+            q.sort()
+            return
+
+        if value < q[0]:
+            q[0] = value
+            k = 0
+        elif value >= q[4]:
+            q[4] = value
+            k = 3
+        else:
+            k = 0
+            while value >= q[k + 1]:
+                k += 1
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                candidate = self._parabolic(i, d)
+                if q[i - 1] < candidate < q[i + 1]:
+                    q[i] = candidate
+                else:
+                    q[i] = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                n[i] += d
+
+    def _parabolic(self, i: int, d: int) -> float:
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def result(self):
+        q = self.heights
+        if not q:
+            return None
+        if len(q) < 5:
+            middle = len(q) // 2
+            return q[middle] if len(q) % 2 else (q[middle - 1] + q[middle]) / 2
+        return q[2]
+
+REDUCERS = {
+    "latest": LatestReducer,
+    "mean": MeanReducer,
+    "minmax": MinMaxReducer,
+    "median": MedianReducer,
+}
+
+def create_reducer(name: str):
+    if name not in REDUCERS:
+        raise ValueError(f"Unknown reduce: {name}. Valid reductions are {list(REDUCERS.keys())}.")
+    return REDUCERS[name]()
@@ -0,0 +1,228 @@
+import argparse
+import asyncio
+import importlib
+import json
+import signal
+import sys
+from websockets.server import serve
+from broadcasting_client import BroadcastingClient
+from camera_frame import BINARY_SUBPROTOCOL
+from logger import Logger
+import robot_clock
+from robot_link import LINK_SUBPROTOCOL, RobotLink
+from sensor_sampler import SensorSampler
+from wire_codec import SUBPROTOCOLS
+
+HUB_CONFIG_FILE = "/home/gbrouwer/Wheels/config/sensor_hub.json"
+
+# Sensor drivers the hub can host, as "module:Class". A module is only imported when a sensor
+# in the config uses it, so a hub without a camera never loads picamera2 or OpenCV.
+PLUGINS = {
+    "ultrasonic": "ultrasonic_sensor:UltrasonicSensorServer",
+    "light": "light_sensors:LightSensorServer",
+    "infrared": "infrared_sensor:InfraredSensorServer",
+    "picamera": "picamera:PicameraServer",
+    "state": "robot_state:RobotStateServer",
+}
+
+def load_plugin(plugin):
+    if plugin not in PLUGINS:
+        raise ValueError(f"Unknown sensor plugin: {plugin}. Valid plugins are {list(PLUGINS.keys())}.")
+    module_name, class_name = PLUGINS[plugin].split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+class SensorHub:
+    """Run several sensor servers in one process and one event loop.
+
+    Every sensor keeps its own WebSocket port and message format, unless `shared_port` is set: then
+    a single server routes each connection by its first path segment (ws://pi:<port>/<sensor name>).
+    With `link_port` set, a client can also open every sensor as a channel of one multiplexed
+    RobotLink connection; channels are routed by name exactly like shared-port paths.
+    The hub opens one broadcasting connection for all sensors, and runs one multi-channel ADC scan
+    that every light sensor reads its channel from. Extra channels (e.g. 2, the battery) can be
+    added to the scan with {"adc": {"channels": [2]}} and show up in the hub's metrics.
+    """
+
+    def __init__(self, config, shared_port=None, link_port=None):
+        self.name = config.get("name", "sensor_hub")
+        self.shared_port = shared_port or config.get("shared_port")
+        self.link_port = link_port or config.get("link_port")
+        self.link_window = config.get("link_window", 16)
+        self.should_run = True
+        self.broadcasting_client = BroadcastingClient()
+        self.log_path = f"/home/gbrouwer/Wheels/logs/{self.name}.log"
+        self.logger = Logger(self.name, self.log_path)
+        self.shared = {}
+        self.sensors = {}
+        self.metrics_interval = 5.0
+        light_channels = [entry.get("options", {}).get("channel", 0) for entry in config["sensors"]
+                          if entry["plugin"] == "light"]
+        if light_channels:
+            self.create_adc_scanner(light_channels, config.get("adc", {}))
+        for entry in config["sensors"]:
+            self.sensors[entry["name"]] = self.create_sensor(entry)
+            self.logger.log(f"Loaded {entry['plugin']} sensor '{entry['name']}'")
+        for entry in config["sensors"]:
+            if entry["plugin"] == "state":
+                self.connect_state_sources(self.sensors[entry["name"]], config)
+
+    def create_adc_scanner(self, light_channels, adc_config):
+        from adc import ADC
+        adc = ADC()
+        channels = sorted(set(light_channels) | set(adc_config.get("channels", [])))
+        oversample = adc_config.get("oversample", 4)
+        self.shared["adc"] = adc
+        self.shared["adc_scanner"] = SensorSampler(lambda: adc.scan(channels, oversample),
+                                                   rate=adc_config.get("rate", 100.0), on_error=self.on_scan_error)
+        self.logger.log(f"Sharing one ADC scan of channels {channels} at {self.shared['adc_scanner'].rate} Hz")
+
+    def on_scan_error(self, error):
+        self.logger.log(f"ADC scan failed: {error}")
+
+    def connect_state_sources(self, state, config):
+        """Point each field of the fused robot state at the sampler that produces it."""
+        def latest_of(sampler, select=lambda value: value):
+            def latest():
+                sample = sampler.latest()
+                return None if sample is None else (sample.timestamp, select(sample.value))
+            return latest
+
+        for entry in config["sensors"]:
+            sensor = self.sensors[entry["name"]]
+            if entry["plugin"] == "ultrasonic":
+                state.add_source("distance", latest_of(sensor.sampler))
+            elif entry["plugin"] == "infrared":
+                state.add_source("ir", latest_of(sensor.sampler))
+            elif entry["plugin"] == "light":
+                field = {0: "light_left", 1: "light_right"}.get(sensor.channel)
+                if field:
+                    state.add_source(field, latest_of(sensor.sampler))
+        if "adc_scanner" in self.shared:
+            # Channel 2 measures the battery through a divider, as in adc.py
+            factor = 3 if self.shared["adc"].pcb_version == 1 else 2
+            def battery():
+                sample = self.shared["adc_scanner"].latest()
+                if sample is None or 2 not in sample.value:
+                    return None
+                reading = sample.value[2]
+                return reading["timestamp"], round(reading["voltage"] * factor, 2)
+            state.add_source("battery", battery)
+
+    def create_sensor(self, entry):
+        sensor_class = load_plugin(entry["plugin"])
+        options = dict(entry.get("options", {}))
+        if entry["plugin"] == "light":
+            options["adc"] = self.shared["adc"]
+            options["scanner"] = self.shared["adc_scanner"]
+        port = None if self.shared_port else entry["port"]
+        return sensor_class(port=port, sensor_name=entry["name"], broadcasting_client=self.broadcasting_client,
+                            **options)
+
+    async def route(self, connection):
+        name = connection.path.strip("/").split("/", 1)[0]
+        sensor = self.sensors.get(name)
+        if sensor is None:
+            self.logger.log(f"Rejected connection for unknown sensor: {connection.path}")
+            await connection.close(1008, f"Unknown sensor: {name}")
+            return
+        await sensor.stream(connection)
+
+    async def serve_link(self, connection):
+        self.logger.log(f"Robot link connected from {connection.remote_address}")
+        link = RobotLink(connection, self.link_window, accept=self.route,
+                         subprotocols=[BINARY_SUBPROTOCOL, *SUBPROTOCOLS], client=False)
+        await link.run()
+        self.logger.log("Robot link closed.")
+
+    async def send_boot_status(self):
+        for name, sensor in self.sensors.items():
+            await sensor.send_status_update({"module": name, "status": "boot_success"})
+        await self.broadcasting_client.send_message({"module": self.name, "status": "boot_success"})
+
+    async def send_status_update(self, message_dict):
+        if self.broadcasting_client.ws:
+            try:
+                await self.broadcasting_client.send_message(message_dict)
+            except Exception as e:
+                self.logger.log(f"Failed to send message to broadcaster: {e}")
+
+        with open(self.log_path, "a") as log_file:
+            log_file.write(json.dumps(message_dict) + "\n")
+
+    async def metrics_loop(self):
+        while self.should_run:
+            await asyncio.sleep(self.metrics_interval)
+            metrics = {}
+            if "adc" in self.shared:
+                latest = self.shared["adc_scanner"].latest()
+                metrics["adc"] = {
+                    "transactions": self.shared["adc"].transactions,
+                    "unstable_reads": self.shared["adc"].unstable_reads,
+                    "scans": self.shared["adc_scanner"].reads,
+                    "voltages": {channel: reading["voltage"] for channel, reading in latest.value.items()}
+                    if latest else {},
+                }
+            metrics["clock"] = robot_clock.CLOCK.stats()
+            await self.send_status_update({"module": self.name, "metrics": metrics})
+
+    async def handle_broadcast(self, data):
+        for sensor in self.sensors.values():
+            handler = getattr(sensor, "handle_broadcast", None)
+            if handler:
+                await handler(data)
+
+    async def run(self):
+        tasks = [asyncio.create_task(self.metrics_loop())]
+        if "adc_scanner" in self.shared:
+            tasks.append(asyncio.create_task(self.shared["adc_scanner"].run()))
+        for sensor in self.sensors.values():
+            tasks.extend(await sensor.start())
+        if self.shared_port:
+            self.logger.log(f"Starting shared WebSocket server on port {self.shared_port}")
+            server = await serve(self.route, "0.0.0.0", self.shared_port, subprotocols=[BINARY_SUBPROTOCOL, *SUBPROTOCOLS])
+            tasks.append(server.wait_closed())
+        if self.link_port:
+            self.logger.log(f"Starting robot link server on port {self.link_port}")
+            link_server = await serve(self.serve_link, "0.0.0.0", self.link_port, subprotocols=[LINK_SUBPROTOCOL])
+            tasks.append(link_server.wait_closed())
+
+        self.broadcasting_client.on_connect_callback = self.send_boot_status
+        self.broadcasting_client.on_message_callback = self.handle_broadcast
+        broadcasting_task = asyncio.create_task(self.broadcasting_client.connect_forever())
+
+        self.logger.log(f"Boot successful. Serving {len(self.sensors)} sensors from one process.")
+        await asyncio.gather(*tasks, broadcasting_task)
+
+    def stop(self):
+        self.should_run = False
+        for name, sensor in self.sensors.items():
+            try:
+                sensor.close()
+            except Exception as e:
+                self.logger.log(f"Failed to close {name}: {e}")
+        if "adc" in self.shared:
+            self.shared["adc_scanner"].stop()
+            self.shared["adc"].close_i2c()
+        self.logger.log("Server shutdown complete.")
+        sys.exit(0)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default=HUB_CONFIG_FILE, help="Sensor hub configuration file")
+    parser.add_argument("--shared-port", type=int, default=None,
+                        help="Serve all sensors on this one port, routed by path, instead of their own ports")
+    parser.add_argument("--link-port", type=int, default=None,
+                        help="Also serve every sensor as a channel of one multiplexed robot link on this port")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = json.load(f)
+
+    hub = SensorHub(config, shared_port=args.shared_port, link_port=args.link_port)
+
+    def shutdown(*_):
+        hub.stop()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    asyncio.run(hub.run())
@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import time
+
+MODULES_FILE = "/home/gbrouwer/Wheels/config/modules.json"
+HUB_CONFIG_FILE = "/home/gbrouwer/Wheels/config/sensor_hub.json"
+HUB_CMD = "python /home/gbrouwer/Wheels/src/sensor_hub.py --config {config}"
+
+def process_tree(pid):
+    """Return pid and all of its descendants, read from /proc."""
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", "r") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return pids
+    for child in children:
+        pids.extend(process_tree(child))
+    return pids
+
+def rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def wait_for_ports(ports, timeout):
+    """Block until every port accepts a TCP connection; return the elapsed seconds or None on timeout."""
+    start = time.perf_counter()
+    pending = set(ports)
+    while pending:
+        if time.perf_counter() - start > timeout:
+            return None
+        for port in list(pending):
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                    pending.discard(port)
+            except OSError:
+                pass
+        time.sleep(0.02)
+    return time.perf_counter() - start
+
+def measure(name, commands, ports, timeout, settle):
+    print(f"[Benchmark] {name}: starting {len(commands)} process(es) for {len(ports)} port(s)")
+    procs = [subprocess.Popen(cmd, shell=True, start_new_session=True,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for cmd in commands]
+    try:
+        boot_time = wait_for_ports(ports, timeout)
+        time.sleep(settle)  # Let capture threads and broadcasting connections reach steady state
+        pids = [pid for proc in procs for pid in process_tree(proc.pid)]
+        rss = sum(rss_kb(pid) for pid in pids)
+    finally:
+        for proc in procs:
+            try:
+                os.killpg(proc.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for proc in procs:
+            proc.wait()
+    return {"layout": name, "processes": len(pids), "boot_s": boot_time, "rss_mb": rss / 1024}
+
+def per_process_layout(modules_file):
+    with open(modules_file, "r") as f:
+        modules = json.load(f)
+    servers = [m for m in modules if m["host"] == "pi" and m.get("type") == "server" and "port" in m]
+    commands = []
+    for m in servers:
+        cmd = f"{m['cmd']} --port {m['port']}"
+        if "publish" in m:
+            cmd = f"{cmd} --publish '{json.dumps(m['publish'])}'"
+        commands.append(cmd)
+    return commands, [m["port"] for m in servers]
+
+def hub_layout(hub_config):
+    with open(hub_config, "r") as f:
+        config = json.load(f)
+    if config.get("shared_port"):
+        ports = [config["shared_port"]]
+    else:
+        ports = [sensor["port"] for sensor in config["sensors"]]
+    return [HUB_CMD.format(config=hub_config)], ports
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare boot time and memory of per-process sensors vs the sensor hub")
+    parser.add_argument("--modules", type=str, default=MODULES_FILE)
+    parser.add_argument("--hub-config", type=str, default=HUB_CONFIG_FILE)
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for all ports to open")
+    parser.add_argument("--settle", type=float, default=3.0, help="Seconds to wait after boot before reading RSS")
+    args = parser.parse_args()
+
+    results = [
+        measure("per-process", *per_process_layout(args.modules), args.timeout, args.settle),
+        measure("sensor hub", *hub_layout(args.hub_config), args.timeout, args.settle),
+    ]
+
+    print(f"{'layout':<14}{'processes':>10}{'boot (s)':>10}{'RSS (MB)':>10}")
+    for r in results:
+        boot = f"{r['boot_s']:.2f}" if r["boot_s"] is not None else "timeout"
+        print(f"{r['layout']:<14}{r['processes']:>10}{boot:>10}{r['rss_mb']:>10.1f}")
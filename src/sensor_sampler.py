@@ -0,0 +1,330 @@
+import asyncio
+import time
+import numpy as np
+from websockets.exceptions import ConnectionClosed
+import robot_clock
+from datagram_transport import DatagramSender
+from fanout import FanoutBuffer
+from sample_reducers import create_reducer
+from wire_codec import codec_for
+
+class Sample:
+    """One timestamped reading. `seq` counts readings of this sensor, so gaps show dropped samples."""
+
+    __slots__ = ("seq", "timestamp", "value")
+
+    def __init__(self, seq: int, timestamp: float, value):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.value = value
+
+class Subscription:
+    """A subscriber's cursor into a sampler's ring. Use as a context manager so it is always released."""
+
+    def __init__(self, samples: FanoutBuffer):
+        self.samples = samples
+        self.cursor = samples.subscribe()
+        self.missed = 0
+
+    async def next(self):
+        """Wait for and return every sample published since the previous call, oldest first."""
+        await self.samples.wait(self.cursor)
+        items, missed = self.samples.since(self.cursor)
+        self.missed += missed
+        if items:
+            self.cursor = items[-1][0]
+        return [sample for _, sample in items]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.samples.unsubscribe()
+
+class SensorSampler:
+    """Read one sensor at a fixed rate and fan the readings out to any number of subscribers.
+
+    There is exactly one hardware read per tick no matter how many clients are connected, so
+    every client sees the same timestamped samples. The blocking read runs in the default
+    executor; the read function may return None when it has no valid reading. Sensors that
+    produce readings on their own (read=None) call publish() instead of running run().
+    With a SampleHistory attached every sample is also recorded for later range queries.
+    """
+
+    def __init__(self, read, rate: float = 10.0, capacity: int = 16, on_error=None, history=None):
+        self.read = read
+        self.rate = rate
+        self.on_error = on_error
+        self.history = history
+        self.samples = FanoutBuffer(capacity)
+        self.should_run = True
+        self.reads = 0
+        self.failures = 0
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / self.rate
+        next_tick = time.monotonic()
+        while self.should_run:
+            timestamp = robot_clock.now()
+            try:
+                value = await loop.run_in_executor(None, self.read)
+            except Exception as e:
+                value = None
+                if self.on_error:
+                    self.on_error(e)
+            if value is None:
+                self.failures += 1
+            else:
+                self.publish(value, timestamp)
+            # Fixed-rate ticks; after an overrun start counting again from now instead of bursting
+            next_tick += interval
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                next_tick = time.monotonic()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    def publish(self, value, timestamp: float) -> None:
+        """Hand a reading to the subscribers; must be called on the event loop thread."""
+        self.reads += 1
+        self.samples.publish(Sample(self.reads, timestamp, value))
+        if self.history is not None:
+            self.history.append(timestamp, value)
+
+    def latest(self):
+        """Return the newest Sample, or None before the first reading."""
+        return self.samples.latest()[1]
+
+    def subscribe(self) -> Subscription:
+        return Subscription(self.samples)
+
+    def stats(self) -> dict:
+        return {"rate": self.rate, "reads": self.reads, "failures": self.failures,
+                "subscribers": self.samples.subscribers}
+
+    def stop(self) -> None:
+        self.should_run = False
+        if self.history is not None:
+            self.history.close()
+
+class PublishPolicy:
+    """Send an output only when it changed significantly, plus a heartbeat to prove liveness.
+
+    A value goes out when it moved more than `deadband` (absolute) or `relative_deadband` times the
+    last sent value, whichever is larger, or when nothing was sent for `max_silence` seconds.
+    With everything at 0 (the default) every output is sent; with only max_silence set, any
+    change is sent and repeats are suppressed.
+    """
+
+    def __init__(self, deadband: float = 0.0, relative_deadband: float = 0.0, max_silence: float = 0.0):
+        if deadband < 0 or relative_deadband < 0 or max_silence < 0:
+            raise ValueError(f"Invalid publish policy: {deadband}, {relative_deadband}, {max_silence}")
+        self.deadband = deadband
+        self.relative_deadband = relative_deadband
+        self.max_silence = max_silence
+        self.enabled = bool(deadband or relative_deadband or max_silence)
+        self.last_value = None
+        self.last_sent = None
+
+    @classmethod
+    def from_dict(cls, policy: dict):
+        return cls(float(policy.get("deadband", 0.0)), float(policy.get("relative_deadband", 0.0)),
+                   float(policy.get("max_silence", 0.0)))
+
+    def to_dict(self) -> dict:
+        return {"deadband": self.deadband, "relative_deadband": self.relative_deadband,
+                "max_silence": self.max_silence}
+
+    def _changed(self, value, last) -> bool:
+        if isinstance(value, dict):
+            return any(self._changed(value[key], last[key]) for key in value)
+        threshold = max(self.deadband, self.relative_deadband * abs(last))
+        return abs(value - last) > threshold
+
+    def should_send(self, value, timestamp: float) -> bool:
+        if not self.enabled:
+            return True
+        if self.last_value is None or value is None or self._changed(value, self.last_value) \
+                or (self.max_silence and timestamp - self.last_sent >= self.max_silence):
+            self.last_value = value
+            self.last_sent = timestamp
+            return True
+        return False
+
+class SampleStream:
+    """Deliver one sampler's readings to one client at the rate and reduction that client asked for.
+
+    Each output message reduces the samples of one window of 1/rate seconds; rate 0 forwards every
+    sample. Clients start at `rate`/`reduce` and can change both at any time by sending
+    {"command": "subscribe", "rate": 50, "reduce": "median", "batch_ms": 100}. Reductions are
+    updated per sample with constant work, so slow and fast subscribers of the same sampler cost
+    the same. With batch_ms set, the outputs of that many milliseconds are sent together as one
+    message of compact arrays (see `batch_message`). A PublishPolicy (the server's default, or
+    "publish": {"deadband": 0.02, "max_silence": 1.0} in the subscribe command) drops outputs
+    that did not change significantly. With "udp_port" in the subscribe command the stream
+    outputs go to that UDP port on the client's address as DatagramSender packets, where a lost
+    reading never holds up newer ones; replies to commands stay on the WebSocket.
+
+    Clients can also ask for recorded history, e.g. to backfill after a reconnect:
+    {"command": "query", "seconds": 5, "rate": 20, "reduce": "mean", "id": 7}, or "start"/"end" in
+    epoch seconds instead of "seconds". The reply has the same columns as a batch plus "query": id.
+    """
+
+    def __init__(self, connection, sampler: SensorSampler, sensor_name: str, value_key: str = "value",
+                 rate: float = 0.0, reduce: str = "latest", publish: dict = None, logger=None):
+        self.connection = connection
+        self.codec = codec_for(connection, {"sensor": sensor_name})  # Negotiated in the handshake; JSON by default
+        self.sampler = sampler
+        self.sensor_name = sensor_name
+        self.value_key = value_key
+        self.logger = logger
+        self.suppressed = 0
+        self.datagram = None
+        self.configure(rate, reduce, publish=publish or {})
+
+    def configure(self, rate: float, reduce: str, batch_ms: float = 0.0, publish: dict = None) -> None:
+        reducer = create_reducer(reduce)
+        policy = PublishPolicy.from_dict(publish or {})
+        if rate < 0 or batch_ms < 0:
+            raise ValueError(f"Invalid rate or batch_ms: {rate}, {batch_ms}")
+        self.rate = rate
+        self.reduce = reduce
+        self.period = 1.0 / rate if rate else 0.0
+        self.reducer = reducer
+        self.count = 0
+        self.window_end = None
+        self.batch_ms = batch_ms
+        self.batch = []  # A pending batch in the old format is dropped on reconfiguration
+        self.policy = policy
+
+    async def set_udp_port(self, port) -> None:
+        current = self.datagram.address[1] if self.datagram else None
+        if port == current:
+            return
+        if self.datagram:
+            self.datagram.close()
+            self.datagram = None
+        if port:
+            host = self.connection.remote_address[0]
+            self.datagram = DatagramSender((host, int(port)))
+            await self.datagram.open()
+
+    async def deliver(self, message: dict) -> None:
+        encoded = self.codec.encode(message)
+        if self.datagram:
+            self.datagram.send(encoded, message.get("timestamp", message.get("t0")))
+        else:
+            await self.connection.send(encoded)
+
+    def query_history(self, data: dict) -> dict:
+        history = self.sampler.history
+        if history is None:
+            raise ValueError("no history is kept for this sensor")
+        end = float(data.get("end", robot_clock.now()))
+        start = float(data.get("start", end - float(data.get("seconds", 5.0))))
+        reduce = data.get("reduce", "latest")
+        timestamps, values = history.query(start, end, float(data.get("rate", 0.0)), reduce)
+        if isinstance(values, dict):
+            values = {key: column.tolist() for key, column in values.items()}
+        else:
+            values = values.tolist()
+        t0 = float(timestamps[0]) if len(timestamps) else start
+        return {"sensor": self.sensor_name, "query": data.get("id"), "batch": len(timestamps), "t0": t0,
+                "dt_ms": np.round((timestamps - t0) * 1000, 1).tolist(), "reduce": reduce, self.value_key: values}
+
+    async def receive_commands(self) -> None:
+        async for message in self.connection:
+            try:
+                data = self.codec.decode(message)
+                if data.get("command") == "query":
+                    await self.connection.send(self.codec.encode(self.query_history(data)))
+                    continue
+                if data.get("command") != "subscribe":
+                    continue
+                self.configure(float(data.get("rate", self.rate)), data.get("reduce", self.reduce),
+                               float(data.get("batch_ms", self.batch_ms)), data.get("publish", self.policy.to_dict()))
+                await self.set_udp_port(data.get("udp_port"))
+                reply = {"sensor": self.sensor_name, "status": "subscribed", "rate": self.rate,
+                         "reduce": self.reduce, "batch_ms": self.batch_ms, "publish": self.policy.to_dict(),
+                         "udp_port": self.datagram.address[1] if self.datagram else None,
+                         "sample_rate": self.sampler.rate}
+            except (ValueError, TypeError, AttributeError, KeyError, OSError) as e:
+                reply = {"sensor": self.sensor_name, "error": f"Invalid command: {e}"}
+            if self.logger:
+                self.logger.log(f"Subscription update: {reply}")
+            await self.connection.send(self.codec.encode(reply))
+
+    def add(self, sample: Sample):
+        """Fold a sample into the current window; return the output message when the window closes."""
+        self.reducer.add(sample.value)
+        self.count += 1
+        if self.window_end is None:
+            self.window_end = sample.timestamp
+        if sample.timestamp < self.window_end:
+            return None
+
+        message = {"sensor": self.sensor_name, self.value_key: self.reducer.result(),
+                   "timestamp": sample.timestamp, "seq": sample.seq}
+        if self.reduce != "latest":
+            message["reduce"] = self.reduce
+            message["count"] = self.count
+        self.reducer.reset()
+        self.count = 0
+        self.window_end += self.period
+        if self.window_end <= sample.timestamp:
+            # Fell behind (e.g. the sampler stalled); restart the windows from now
+            self.window_end = sample.timestamp + self.period
+        return message
+
+    def collect(self, message: dict):
+        """Add an output message to the current batch; return the batch message once batch_ms has passed."""
+        if not self.batch_ms:
+            return message
+        self.batch.append(message)
+        if (message["timestamp"] - self.batch[0]["timestamp"]) * 1000 < self.batch_ms:
+            return None
+        batch, self.batch = self.batch, []
+        return self.batch_message(batch)
+
+    def batch_message(self, batch) -> dict:
+        """Pack messages into columns: one start time, millisecond offsets and one array per field.
+
+        {"sensor": "light_sensor_left", "batch": 3, "t0": 1718000000.25, "dt_ms": [0.0, 10.0, 20.1],
+         "seq": [812, 814], "value": [1.21, 1.22, 1.22]}
+        Min/max reductions become {"min": [...], "max": [...]} and reduced batches carry "count": [...].
+        """
+        t0 = batch[0]["timestamp"]
+        values = [m[self.value_key] for m in batch]
+        if isinstance(values[0], dict):
+            values = {key: [v[key] for v in values] for key in values[0]}
+        message = {"sensor": self.sensor_name, "batch": len(batch), "t0": t0,
+                   "dt_ms": [round((m["timestamp"] - t0) * 1000, 1) for m in batch],
+                   "seq": [batch[0]["seq"], batch[-1]["seq"]], self.value_key: values}
+        if self.reduce != "latest":
+            message["reduce"] = self.reduce
+            message["count"] = [m["count"] for m in batch]
+        return message
+
+    async def run(self) -> None:
+        receiver = asyncio.create_task(self.receive_commands())
+        try:
+            with self.sampler.subscribe() as subscription:
+                while self.sampler.should_run:
+                    for sample in await subscription.next():
+                        message = self.add(sample)
+                        if message and not self.policy.should_send(message[self.value_key], message["timestamp"]):
+                            self.suppressed += 1
+                            message = None
+                        if message:
+                            message = self.collect(message)
+                        if message:
+                            await self.deliver(message)
+        finally:
+            if self.datagram:
+                self.datagram.close()
+            receiver.cancel()
+            try:
+                await receiver
+            except (asyncio.CancelledError, ConnectionClosed):
+                pass
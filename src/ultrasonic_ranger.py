@@ -0,0 +1,81 @@
+import time
+import robot_clock
+from collections import deque
+
+class UltrasonicRanger:
+    """Filter raw ultrasonic readings into a stable distance.
+
+    Meant to be called at a fixed rate from a worker thread (see CaptureWorker), so echo timing
+    never runs on the event loop. gpiozero clamps "nothing in range" to the sensor's maximum, so
+    readings at or beyond it are published as `max_distance` and counted as out of range; only a
+    missing reading counts as a timeout.
+    A reading that jumps more than `max_jump` cm away from the running median is rejected as an
+    outlier, unless `confirm` such readings arrive in a row, in which case the object really moved
+    and the filter restarts from the new distance. Published values are the median of the last
+    `window` accepted readings.
+    """
+
+    def __init__(self, read, max_distance: float = 300.0, window: int = 5, max_jump: float = 30.0, confirm: int = 3):
+        self.read = read
+        self.max_distance = max_distance
+        self.max_jump = max_jump
+        self.confirm = confirm
+        self.readings = deque(maxlen=window)
+        self.outlier_run = 0
+        self.pings = 0
+        self.timeouts = 0
+        self.out_of_range = 0
+        self.rejected = 0
+        self._reset(time.monotonic())
+
+    def _reset(self, now: float) -> None:
+        self.window_start = now
+        self.window_pings = 0
+        self.window_timeouts = 0
+        self.window_out_of_range = 0
+
+    def _median(self) -> float:
+        ordered = sorted(self.readings)
+        middle = len(ordered) // 2
+        return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+    def ping(self):
+        """Take one reading; return (timestamp, filtered distance in cm) or None if nothing usable came back."""
+        timestamp = robot_clock.now()
+        distance = self.read()
+        self.pings += 1
+        self.window_pings += 1
+        if distance is None:
+            self.timeouts += 1
+            self.window_timeouts += 1
+            return None
+        if distance >= self.max_distance:
+            # Open space; goes through the outlier filter like any reading so a single bad echo is still rejected
+            distance = self.max_distance
+            self.out_of_range += 1
+            self.window_out_of_range += 1
+        if self.readings and abs(distance - self._median()) > self.max_jump:
+            self.outlier_run += 1
+            if self.outlier_run < self.confirm:
+                self.rejected += 1
+                return None
+            self.readings.clear()
+        self.outlier_run = 0
+        self.readings.append(distance)
+        return timestamp, round(self._median(), 1)
+
+    def window(self) -> dict:
+        """Return ping rate and counters since the last call and start a new window."""
+        now = time.monotonic()
+        elapsed = max(now - self.window_start, 1e-6)
+        stats = {
+            "ping_rate": round(self.window_pings / elapsed, 1),
+            "timeouts": self.window_timeouts,
+            "out_of_range": self.window_out_of_range,
+            "total_pings": self.pings,
+            "total_timeouts": self.timeouts,
+            "total_out_of_range": self.out_of_range,
+            "total_rejected": self.rejected,
+        }
+        self._reset(now)
+        return stats
@@ -4,20 +4,39 @@ import signal
 import sys
 import websockets
 from ultrasonic import Ultrasonic  # <-- your real sensor driver
+from ultrasonic_ranger import UltrasonicRanger
 from broadcasting_client import BroadcastingClient
+from capture_worker import CaptureWorker
 from logger import Logger
+from wire_codec import SUBPROTOCOLS
+from sample_history import SampleHistory
+from sensor_sampler import SampleStream, SensorSampler
 
 class UltrasonicSensorServer:
-    def __init__(self, port=6603, sensor_name="ultrasonic_sensor"):
+    def __init__(self, port=6603, sensor_name="ultrasonic_sensor", collision_distance=10.0, sample_rate=20.0, rate=1.0,
+                 history_size=65536, history_file=None, publish=None, broadcasting_client=None):
         self.port = port
         self.sensor_name = sensor_name
+        self.collision_distance = collision_distance  # cm; 0 disables collision events
+        self.in_collision = False
         self.should_run = True
-        self.broadcasting_client = BroadcastingClient()
+        self.broadcasting_client = broadcasting_client or BroadcastingClient()
         self.log_path = f"/home/gbrouwer/Wheels/logs/{self.sensor_name}.log"
         self.logger = Logger(self.sensor_name, self.log_path)
         self.ultrasonic = Ultrasonic(trigger_pin=27, echo_pin=22)  # Initialize your ultrasonic hardware
-
-    async def handle_client(self, websocket):
+        # Pings run in their own thread; filtered distances are handed to the sampler on the event loop
+        self.ranger = UltrasonicRanger(self.ultrasonic.get_distance, max_distance=self.ultrasonic.max_distance * 100)
+        self.worker = CaptureWorker(self.ranger.ping, interval=1.0 / sample_rate, on_error=self.on_read_error,
+                                    name="ultrasonic-ranger")
+        self.sampler = SensorSampler(None, rate=sample_rate, history=SampleHistory(history_size, history_file))
+        self.metrics_interval = 5.0
+        self.publish = publish  # Default publish policy (deadband / max silence) for every client
+        self.rate = rate  # Default output rate for clients that do not send a subscribe command
+
+    def on_read_error(self, error):
+        self.logger.log(f"Warning: Ultrasonic reading failed: {error}")
+
+    async def stream(self, websocket):
         self.logger.log("Unity client connected.")
 
         # Send status update: Unity client connected
@@ -27,27 +46,9 @@ class UltrasonicSensorServer:
         })
 
         try:
-            while self.should_run:
-                distance = self.ultrasonic.get_distance()  # Read real measurement
-                if distance is None:
-                    self.logger.log("Warning: Ultrasonic reading timed out or failed.")
-                    continue
-
-                payload = json.dumps({
-                    "sensor": self.sensor_name,
-                    "distance": distance
-                })
-
-                # Send to Unity client
-                await websocket.send(payload)
-
-                # # Also send reading to orchestrator via broadcasting channel
-                # await self.send_status_update({
-                #     "module": self.sensor_name,
-                #     "reading": {"distance": distance}
-                # })
-
-                await asyncio.sleep(1)
+            # Send readings to the Unity client at the rate and reduction it subscribed with
+            await SampleStream(websocket, self.sampler, self.sensor_name, value_key="distance", rate=self.rate,
+                               publish=self.publish, logger=self.logger).run()
         except websockets.ConnectionClosed:
             self.logger.log("Unity client disconnected.")
             await self.send_status_update({
@@ -55,9 +56,41 @@ class UltrasonicSensorServer:
                 "status": "unity_client_disconnected"
             })
 
+    async def ranging_loop(self):
+        self.worker.start()
+        while self.should_run:
+            timestamp, distance = await self.worker.get()
+            self.sampler.publish(distance, timestamp)
+
+    async def metrics_loop(self):
+        while self.should_run:
+            await asyncio.sleep(self.metrics_interval)
+            metrics = self.ranger.window()
+            metrics["dropped_handoff"] = self.worker.dropped
+            metrics["subscribers"] = self.sampler.samples.subscribers
+            await self.send_status_update({"module": self.sensor_name, "metrics": metrics})
+
+    async def collision_loop(self):
+        # Watch every sample, whether or not a client is connected
+        with self.sampler.subscribe() as subscription:
+            while self.should_run:
+                for sample in await subscription.next():
+                    await self.check_collision(sample.value)
+
+    async def check_collision(self, distance):
+        # Announce once when something comes closer than collision_distance, re-arm once it backs off
+        if not self.collision_distance:
+            return
+        if not self.in_collision and distance < self.collision_distance:
+            self.in_collision = True
+            self.logger.log(f"Collision event at {distance} cm")
+            await self.send_status_update({"module": self.sensor_name, "event": "collision", "distance": distance})
+        elif self.in_collision and distance > self.collision_distance * 1.5:
+            self.in_collision = False
+
     async def start_server(self):
         self.logger.log(f"Starting WebSocket server on port {self.port}")
-        return await websockets.serve(self.handle_client, "0.0.0.0", self.port)
+        return await websockets.serve(self.stream, "0.0.0.0", self.port, subprotocols=SUBPROTOCOLS)
 
     async def send_status_update(self, message_dict):
         if self.broadcasting_client.ws:
@@ -73,8 +106,20 @@ class UltrasonicSensorServer:
         except Exception as e:
             self.logger.log(f"Failed to write status log: {e}")
 
-    async def run(self):
+    async def start(self):
+        """Start serving and return the awaitables that keep this module running.
+
+        With port=None no server is opened; a sensor hub routes connections to stream() instead.
+        """
+        tasks = [asyncio.create_task(self.ranging_loop()), asyncio.create_task(self.collision_loop()),
+                 asyncio.create_task(self.metrics_loop())]
+        if self.port is None:
+            return tasks
         server = await self.start_server()
+        return [server.wait_closed(), *tasks]
+
+    async def run(self):
+        tasks = await self.start()
 
         async def send_boot_status():
             await self.send_status_update({"module": self.sensor_name, "status": "boot_success"})
@@ -86,14 +131,19 @@ class UltrasonicSensorServer:
         self.logger.log("Boot successful. Running server and broadcasting client.")
 
         await asyncio.gather(
-            server.wait_closed(),
+            *tasks,
             broadcasting_task,
         )
 
+    def close(self):
+        self.should_run = False
+        self.sampler.stop()
+        self.worker.stop()
+        self.ultrasonic.close()  # Gracefully release GPIO resources
+
     def stop(self):
         self.logger.log("Shutting down...")
-        self.ultrasonic.close()  # Gracefully release GPIO resources
-        self.should_run = False
+        self.close()
         sys.exit(0)
 
 if __name__ == "__main__":
@@ -101,9 +151,19 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", type=int, required=True, help="Port number for the sensor server")
+    parser.add_argument("--collision-distance", type=float, default=10.0,
+                        help="Distance in cm below which a collision event is broadcast (0 disables)")
+    parser.add_argument("--sample-rate", type=float, default=20.0, help="Pings per second")
+    parser.add_argument("--rate", type=float, default=1.0, help="Default messages per second per client")
+    parser.add_argument("--history-size", type=int, default=65536, help="Samples kept for history queries")
+    parser.add_argument("--history-file", type=str, default=None, help="Memory-map the history to this file")
+    parser.add_argument("--publish", type=json.loads, default=None,
+                        help='Publish policy as JSON, e.g. \'{"deadband": 0.02, "max_silence": 1.0}\'')
     args = parser.parse_args()
 
-    server = UltrasonicSensorServer(port=args.port)
+    server = UltrasonicSensorServer(port=args.port, collision_distance=args.collision_distance,
+                                    sample_rate=args.sample_rate, rate=args.rate, history_size=args.history_size,
+                                    history_file=args.history_file, publish=args.publish)
 
     def shutdown(*_):
         server.stop()
@@ -0,0 +1,127 @@
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:  # Optional; without it the msgpack codec is simply not offered
+    msgpack = None
+
+STRUCT_SUBPROTOCOL = "wheels.struct.v1"
+MSGPACK_SUBPROTOCOL = "wheels.msgpack.v1"
+
+class Schema:
+    """Fixed binary layout of one message type: a type byte followed by `fields` packed as `layout`.
+
+    `constants` are fields that never change on a connection (such as the sensor name); they are
+    left out of the packed message and restored from the codec's context when decoding.
+    `integers` are fields that must hold ints for a message to use this schema, so integer values
+    (the infrared bitmask) keep their type instead of coming back as floats.
+    """
+
+    def __init__(self, type_id: int, name: str, fields, layout: str, constants=(), integers=()):
+        self.type_id = type_id
+        self.name = name
+        self.fields = list(fields)
+        self.constants = list(constants)
+        self.integers = list(integers)
+        self.packer = struct.Struct("!B" + layout)
+        self.key = frozenset(self.fields) | frozenset(self.constants)
+
+    def accepts(self, message: dict) -> bool:
+        return all(isinstance(message[field], int) for field in self.integers)
+
+SCHEMAS = [
+    # Schemas sharing a key are tried in order, so the integer variant must come first
+    Schema(4, "sample_int", ["seq", "timestamp", "value"], "Idq", constants=["sensor"], integers=["value"]),
+    Schema(1, "sample", ["seq", "timestamp", "value"], "Idd", constants=["sensor"]),
+    Schema(2, "distance", ["seq", "timestamp", "distance"], "Idd", constants=["sensor"]),
+    Schema(3, "motor", ["d1", "d2", "d3", "d4"], "4h"),
+]
+SCHEMAS_BY_KEY = {}
+for _schema in SCHEMAS:
+    SCHEMAS_BY_KEY.setdefault(_schema.key, []).append(_schema)
+SCHEMAS_BY_ID = {schema.type_id: schema for schema in SCHEMAS}
+
+# Integer keys for msgpack; keys not listed here are sent as strings
+KEY_IDS = {key: i for i, key in enumerate([
+    "sensor", "value", "distance", "timestamp", "seq", "reduce", "count", "batch", "t0", "dt_ms",
+    "min", "max", "query", "status", "error", "module", "event", "command", "d1", "d2", "d3", "d4",
+    "t", "v", "age_ms", "fields", "rate",
+])}
+KEY_NAMES = {i: key for key, i in KEY_IDS.items()}
+
+class JsonCodec:
+    name = "json"
+    subprotocol = None
+
+    def __init__(self, context: dict = None):
+        self.context = context or {}
+
+    def encode(self, message: dict):
+        return json.dumps(message)
+
+    def decode(self, message) -> dict:
+        return json.loads(message)
+
+class StructCodec(JsonCodec):
+    """Pack messages that match a Schema into fixed structs; anything else goes out as JSON text.
+
+    A WebSocket frame is either binary (a struct) or text (JSON), so both can share a connection.
+    """
+
+    name = "struct"
+    subprotocol = STRUCT_SUBPROTOCOL
+
+    def encode(self, message: dict):
+        for schema in SCHEMAS_BY_KEY.get(frozenset(message), ()):
+            if not schema.accepts(message):
+                continue
+            try:
+                return schema.packer.pack(schema.type_id, *(message[field] for field in schema.fields))
+            except struct.error:
+                continue  # Right keys, but a value that does not fit (None, a float duty, out of range)
+        return json.dumps(message)
+
+    def decode(self, message) -> dict:
+        if isinstance(message, str):
+            return json.loads(message)
+        schema = SCHEMAS_BY_ID[message[0]]
+        values = schema.packer.unpack(message)[1:]
+        decoded = {key: self.context.get(key) for key in schema.constants}
+        decoded.update(zip(schema.fields, values))
+        return decoded
+
+class MsgpackCodec(JsonCodec):
+    """msgpack with the common keys replaced by small integers (see KEY_IDS)."""
+
+    name = "msgpack"
+    subprotocol = MSGPACK_SUBPROTOCOL
+
+    def encode(self, message: dict):
+        return msgpack.packb(self._keys_to_ids(message))
+
+    def decode(self, message) -> dict:
+        if isinstance(message, str):
+            return json.loads(message)
+        return self._ids_to_keys(msgpack.unpackb(message, strict_map_key=False))
+
+    def _keys_to_ids(self, value):
+        if isinstance(value, dict):
+            return {KEY_IDS.get(key, key): self._keys_to_ids(item) for key, item in value.items()}
+        return value
+
+    def _ids_to_keys(self, value):
+        if isinstance(value, dict):
+            return {KEY_NAMES.get(key, key): self._ids_to_keys(item) for key, item in value.items()}
+        return value
+
+CODECS = [StructCodec, MsgpackCodec] if msgpack else [StructCodec]
+SUBPROTOCOLS = [codec.subprotocol for codec in CODECS]
+
+def codec_for(connection, context: dict = None):
+    """Return the codec matching the subprotocol negotiated in the WebSocket handshake (JSON if none)."""
+    subprotocol = getattr(connection, "subprotocol", None)
+    for codec in CODECS:
+        if codec.subprotocol == subprotocol:
+            return codec(context)
+    return JsonCodec(context)
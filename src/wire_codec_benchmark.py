@@ -0,0 +1,40 @@
+import argparse
+import time
+from wire_codec import CODECS, JsonCodec
+
+# Representative messages of every kind the modules exchange
+MESSAGES = {
+    "light sample": {"sensor": "light_sensor_left", "value": 1.23, "timestamp": 1718000000.123456, "seq": 81234},
+    "distance": {"sensor": "ultrasonic_sensor", "distance": 42.7, "timestamp": 1718000000.123456, "seq": 81234},
+    "motor command": {"d1": 1500, "d2": 1500, "d3": -1500, "d4": -1500},
+    "batch (10)": {"sensor": "light_sensor_left", "batch": 10, "t0": 1718000000.123456,
+                   "dt_ms": [float(i * 10) for i in range(10)], "seq": [100, 109],
+                   "value": [1.2 + i * 0.01 for i in range(10)]},
+    "robot state": {"t": 1718000000.123456, "seq": 5000, "v": [42.7, 5, 1.23, 1.31, 7.9, [1500, 1500, -1500, -1500]],
+                    "age_ms": [12, 3, 8, 8, 8, 140]},
+}
+
+def measure(codec, message, iterations):
+    encoded = codec.encode(message)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        codec.encode(message)
+    encode_us = (time.perf_counter() - start) / iterations * 1e6
+    start = time.perf_counter()
+    for _ in range(iterations):
+        codec.decode(encoded)
+    decode_us = (time.perf_counter() - start) / iterations * 1e6
+    size = len(encoded.encode("utf-8") if isinstance(encoded, str) else encoded)
+    return size, encode_us, decode_us
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare wire codecs on size and encode/decode time")
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    codecs = [JsonCodec({"sensor": "light_sensor_left"})] + [codec({"sensor": "light_sensor_left"}) for codec in CODECS]
+    print(f"{'message':<15}{'codec':<9}{'bytes':>7}{'encode us':>11}{'decode us':>11}")
+    for name, message in MESSAGES.items():
+        for codec in codecs:
+            size, encode_us, decode_us = measure(codec, message, args.iterations)
+            print(f"{name:<15}{codec.name:<9}{size:>7}{encode_us:>11.2f}{decode_us:>11.2f}")